@@ -0,0 +1,5 @@
+"""Allocation engine shared by the Streamlit pages.
+
+Modules here are imported once per server process; page scripts re-run on
+every interaction but only pay for a ``sys.modules`` lookup.
+"""
@@ -0,0 +1,187 @@
+import itertools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from allocator.blobstore import BLOB_STORE_DIR
+from allocator.locks import process_wide
+
+try:
+    import fcntl
+except ImportError:  # Windows: slots are only counted within this process
+    fcntl = None
+
+# CPU-heavy stages (PDF extraction, allocation, exports) running at once
+# across all sessions and every app process on the host (UI and HTTP API);
+# the rest wait in a fair queue
+ADMISSION_SLOTS = int(os.environ.get("ADMISSION_SLOTS", os.cpu_count() or 1))
+# How often a waiting stage reports its queue position
+ADMISSION_POLL_SECONDS = float(os.environ.get("ADMISSION_POLL_SECONDS", 0.5))
+# One lock file per slot, flock()ed by whichever process is using it; kept
+# in the store's top level, which eviction leaves alone
+ADMISSION_LOCK_PATTERN = os.path.join(BLOB_STORE_DIR, "admission-slot-{}.lock")
+
+
+class _Ticket:
+    __slots__ = ("seq", "user", "stage", "weight", "lock_fds")
+
+    def __init__(self, seq: int, user: str, stage: str, weight: int):
+        self.seq = seq
+        self.user = user
+        self.stage = stage
+        self.weight = weight
+        self.lock_fds: List[int] = []
+
+
+def _lock_host_slots(weight: int, slots: int) -> Optional[List[int]]:
+    """Take ``weight`` of the host-wide slot locks without blocking; None if not enough are free"""
+    if fcntl is None:
+        return []
+    fds = []
+    for i in range(slots):
+        fd = os.open(ADMISSION_LOCK_PATTERN.format(i), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            continue
+        fds.append(fd)
+        if len(fds) == weight:
+            return fds
+    _unlock_host_slots(fds)
+    return None
+
+
+def _unlock_host_slots(fds: List[int]) -> None:
+    for fd in fds:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+class AdmissionQueue:
+    """Bounded slots for heavy work, handed out round-robin across users
+
+    Waiting stages are ordered by how many stages their user has already
+    been given since they last had nothing queued or running, so one user
+    submitting many invoices can't starve everyone else; ties are FIFO.
+    A stage admitted here also takes slot lock files shared with the other
+    app processes, so the cap holds host-wide; between processes, order is
+    first come first served.
+    """
+
+    def __init__(self, slots: int = ADMISSION_SLOTS):
+        self.slots = max(1, slots)
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting: List[_Ticket] = []
+        self._running: Dict[str, int] = {}
+        self._served: Dict[str, int] = {}
+        self._used = 0
+        os.makedirs(os.path.dirname(ADMISSION_LOCK_PATTERN) or ".", exist_ok=True)
+
+    def _order(self) -> List[_Ticket]:
+        seen: Dict[str, int] = {}
+        ranked = []
+        for ticket in self._waiting:
+            turn = self._served.get(ticket.user, 0) + seen.get(ticket.user, 0)
+            seen[ticket.user] = seen.get(ticket.user, 0) + 1
+            ranked.append((turn, ticket.seq, ticket))
+        return [ticket for _, _, ticket in sorted(ranked, key=lambda r: r[:2])]
+
+    def _admissible(self, ticket: _Ticket) -> bool:
+        free = self.slots - self._used
+        for queued in self._order():
+            if queued is ticket:
+                return ticket.weight <= free
+            free -= queued.weight
+            if free <= 0:
+                return False
+        return False
+
+    def _lock_host(self, ticket: _Ticket) -> bool:
+        fds = _lock_host_slots(ticket.weight, self.slots)
+        if fds is None:
+            return False
+        ticket.lock_fds = fds
+        return True
+
+    @contextmanager
+    def slot(self, user: str, stage: str, weight: int = 1,
+             on_wait: Optional[Callable[[int], None]] = None):
+        """Hold ``weight`` slots for a heavy stage, waiting in the queue first
+
+        ``on_wait`` is called with the queue position while waiting (from
+        the caller's thread, so it can update the UI).
+        """
+        ticket = _Ticket(next(self._seq), user, stage, min(max(1, weight), self.slots))
+        with self._cond:
+            self._waiting.append(ticket)
+            try:
+                while not (self._admissible(ticket) and self._lock_host(ticket)):
+                    if on_wait is not None:
+                        position = self._order().index(ticket) + 1
+                        self._cond.release()
+                        try:
+                            on_wait(position)
+                        finally:
+                            self._cond.acquire()
+                    self._cond.wait(ADMISSION_POLL_SECONDS)
+            finally:
+                self._waiting.remove(ticket)
+            self._used += ticket.weight
+            self._running[user] = self._running.get(user, 0) + 1
+            self._served[user] = self._served.get(user, 0) + 1
+        try:
+            yield ticket.weight
+        finally:
+            with self._cond:
+                _unlock_host_slots(ticket.lock_fds)
+                self._used -= ticket.weight
+                self._running[user] -= 1
+                if not self._running[user]:
+                    del self._running[user]
+                    if not any(t.user == user for t in self._waiting):
+                        del self._served[user]
+                self._cond.notify_all()
+
+
+@process_wide
+def get_admission_queue() -> AdmissionQueue:
+    """The queue every job of this process waits in for a slot"""
+    return AdmissionQueue()
+
+
+@process_wide
+def get_worker_pool() -> ProcessPoolExecutor:
+    """Process-wide worker processes for CPU-bound stages, one per admission slot
+
+    Workers come from a forkserver, not a fork of this multi-threaded server
+    (a fork can copy locks held by other threads). Where forkserver isn't
+    available (Windows) they are spawned.
+    """
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=max(1, ADMISSION_SLOTS), mp_context=multiprocessing.get_context(method))
+
+
+def run_in_worker(fn: Callable, *args, on_poll: Optional[Callable[[], None]] = None):
+    """``fn(*args)`` run on the worker processes, off this process's GIL
+
+    ``fn`` must be a module-level function and its arguments and result
+    picklable. ``on_poll`` is called every ADMISSION_POLL_SECONDS while it
+    runs; if it raises (e.g. the job was cancelled) the result is dropped,
+    though the worker finishes the call.
+    """
+    future = get_worker_pool().submit(fn, *args)
+    try:
+        while True:
+            try:
+                return future.result(timeout=ADMISSION_POLL_SECONDS)
+            except FutureTimeoutError:
+                if on_poll is not None:
+                    on_poll()
+    finally:
+        future.cancel()
@@ -0,0 +1,146 @@
+import io
+import json
+import re
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from allocator.invoice import PRODUCT_ITEMS, LineItem
+
+# Column names used by Atlassian billing exports (and close variants), matched
+# case-insensitively with spaces and punctuation removed; first match wins
+EXPORT_COLUMNS = {
+    "description": ["description", "productdescription", "productname", "product", "item", "name"],
+    "quantity": ["quantity", "qty", "users", "usercount", "licensedusers", "seats", "units", "unitcount"],
+    "unit_price": ["unitprice", "price", "listprice"],
+    "amount_excl_tax": ["amountexcltax", "amountexcludingtax", "amountbeforetax", "netamount", "subtotal"],
+    "tax": ["tax", "taxamount", "vat", "vatamount", "gst"],
+    "amount_incl_tax": ["amountincltax", "amountincludingtax", "total", "totalamount", "grossamount"],
+    "amount": ["amount", "cost", "charge"],
+    "currency": ["currency", "currencycode"],
+    "invoice_number": ["invoicenumber", "invoiceno", "invoiceid", "invoice"],
+    "period_start": ["billingperiodstart", "periodstart", "servicestart", "startdate", "billingperiodstartdate"],
+    "period_end": ["billingperiodend", "periodend", "serviceend", "enddate", "billingperiodenddate"],
+}
+# JSON exports keep their line items under one of these keys
+JSON_LINE_KEYS = ["lineItems", "line_items", "items", "lines", "invoiceItems", "invoice_items"]
+MONEY_COLUMNS = ["unit_price", "amount_excl_tax", "tax", "amount_incl_tax"]
+
+
+def is_billing_export(data: bytes) -> bool:
+    """True for CSV/JSON billing exports, False for PDF invoices"""
+    return not data.lstrip()[:5].startswith(b"%PDF")
+
+
+def _normalize(name: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", str(name).lower())
+
+
+def _export_frame(data: bytes) -> Tuple[pd.DataFrame, Dict]:
+    """Line-item rows of an export, plus top-level fields of a JSON export"""
+    text = data.decode("utf-8-sig")
+    if text.lstrip()[:1] not in ("{", "["):
+        return pd.read_csv(io.StringIO(text), dtype=str, keep_default_na=False), {}
+
+    document = json.loads(text)
+    header = {}
+    records = document
+    if isinstance(document, dict):
+        key = next((k for k in JSON_LINE_KEYS if isinstance(document.get(k), list)), None)
+        if key is None:
+            raise ValueError(f"JSON billing export has no line items (expected one of: {', '.join(JSON_LINE_KEYS)})")
+        records = document[key]
+        header = pd.json_normalize({k: v for k, v in document.items() if k != key}, sep="_").iloc[0].to_dict()
+    return pd.json_normalize(records, sep="_"), header
+
+
+def _pick(columns: Dict[str, str], field: str) -> Optional[str]:
+    return next((columns[alias] for alias in EXPORT_COLUMNS[field] if alias in columns), None)
+
+
+def _money(value) -> Optional[float]:
+    """Numbers, or strings like 'USD 1,234.50'; None for blanks"""
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    cleaned = re.sub(r"[^\d.\-]", "", str(value))
+    return float(cleaned) if cleaned not in ("", "-", ".") else None
+
+
+def _date(value) -> Optional[str]:
+    parsed = pd.to_datetime(value, errors="coerce", utc=True) if value not in (None, "") else pd.NaT
+    return None if pd.isna(parsed) else parsed.strftime("%Y-%m-%d")
+
+
+def parse_billing_export(data: bytes) -> Tuple[List[Optional[LineItem]], Dict[str, Optional[str]], Dict]:
+    """Line items, invoice meta and column layout of a CSV/JSON billing export
+
+    Produces the same per-product ``LineItem`` records as ``parse_line_items``
+    (several rows for one product are added up), the meta of
+    ``extract_invoice_meta`` and a layout like ``detect_layout``'s.
+    Raises ValueError if the export has no product description column.
+    """
+    frame, header = _export_frame(data)
+    columns = {_normalize(c): c for c in frame.columns}
+    header = {_normalize(k): v for k, v in header.items()}
+    description = _pick(columns, "description")
+    if description is None:
+        raise ValueError("Billing export has no product/description column")
+
+    field_columns = {field: _pick(columns, field) for field in MONEY_COLUMNS}
+    amount = _pick(columns, "amount")
+    if amount is not None:
+        # A plain Amount is the final amount when tax is listed, as on the PDF
+        target = "amount_incl_tax" if field_columns["tax"] else "amount_excl_tax"
+        field_columns[target] = field_columns[target] or amount
+    money_columns = [field for field in MONEY_COLUMNS if field_columns[field]]
+    quantity = _pick(columns, "quantity")
+    currency = _pick(columns, "currency")
+
+    # Each row goes to the most specific product it names, so app rows like
+    # "draw.io Diagrams | Confluence" don't count towards Confluence itself
+    names = sorted((name for name, _ in PRODUCT_ITEMS), key=len, reverse=True)
+    products = [
+        next((name for name in names if name.lower() in desc), None)
+        for desc in frame[description].astype(str).str.lower()
+    ]
+    items = []
+    for name, _ in PRODUCT_ITEMS:
+        rows = frame[[product == name for product in products]]
+        if rows.empty:
+            items.append(None)
+            continue
+        item = LineItem(str(rows[description].iloc[0]).strip())
+        for field in money_columns:
+            values = [v for v in (_money(v) for v in rows[field_columns[field]]) if v is not None]
+            if values:
+                setattr(item, field, round(sum(values), 2))
+        if quantity is not None:
+            counts = [v for v in (_money(v) for v in rows[quantity]) if v is not None]
+            item.quantity = int(sum(counts)) if counts else None
+        if currency is not None:
+            item.currency = str(rows[currency].iloc[0]) or None
+        items.append(item)
+
+    def first(field):
+        column = _pick(columns, field)
+        values = [v for v in frame[column] if v not in (None, "")] if column else []
+        if values:
+            return values[0]
+        return next((header[alias] for alias in EXPORT_COLUMNS[field] if header.get(alias) not in (None, "")), None)
+
+    period_start = _date(first("period_start"))
+    invoice_number = first("invoice_number")
+    meta = {
+        "invoice_number": str(invoice_number) if invoice_number is not None else None,
+        "period": period_start[:7] if period_start else None,
+        "period_start": period_start,
+        "period_end": _date(first("period_end")),
+    }
+    layout = {
+        "money_columns": money_columns,
+        "has_vat": "tax" in money_columns or "amount_incl_tax" in money_columns,
+        "source": "export",
+    }
+    return items, meta, layout
@@ -0,0 +1,143 @@
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+from typing import Optional
+
+import pandas as pd
+
+from allocator.locks import process_wide
+
+# Local spill directory for uploads and results, shared by all sessions
+BLOB_STORE_DIR = os.environ.get("BLOB_STORE_DIR", "uploads")
+# Blobs not read or written for this long are evicted
+BLOB_STORE_TTL_SECONDS = int(os.environ.get("BLOB_STORE_TTL_SECONDS", 6 * 60 * 60))
+# Upper bound on the store size; least recently used blobs are evicted first
+BLOB_STORE_MAX_BYTES = int(os.environ.get("BLOB_STORE_MAX_BYTES", 512 * 1024 * 1024))
+# Eviction walks the whole store, so it runs at most this often, or sooner
+# once a tenth of BLOB_STORE_MAX_BYTES has been written since the last pass
+BLOB_STORE_EVICT_INTERVAL_SECONDS = int(os.environ.get("BLOB_STORE_EVICT_INTERVAL_SECONDS", 5 * 60))
+
+
+class BlobStore:
+    """Content-addressed file store keyed by SHA-256, with TTL and size eviction
+
+    Identical uploads from different sessions share one file, and sessions
+    only keep the hex digest. A blob's mtime is bumped on every access so
+    eviction is least-recently-used. Eviction runs on a timer and a count of
+    bytes written rather than on every put.
+    """
+
+    def __init__(self, root: str = BLOB_STORE_DIR, ttl_seconds: int = BLOB_STORE_TTL_SECONDS,
+                 max_bytes: int = BLOB_STORE_MAX_BYTES):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._last_evict = 0.0
+        self._written = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, data: bytes) -> str:
+        """Store bytes (if not already present) and return their digest"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if os.path.exists(path):
+            self._touch(path)
+            return digest
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.written(len(data))
+        return digest
+
+    def get(self, digest: Optional[str]) -> Optional[bytes]:
+        """Return the stored bytes, or None if unknown or already evicted"""
+        if not digest:
+            return None
+        path = self._path(digest)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self._touch(path)
+        return data
+
+    def exists(self, digest: Optional[str]) -> bool:
+        return bool(digest) and os.path.exists(self._path(digest))
+
+    def put_frame(self, obj) -> str:
+        """Pickle a DataFrame (or any result object) into the store"""
+        buf = io.BytesIO()
+        pd.to_pickle(obj, buf)
+        return self.put(buf.getvalue())
+
+    def get_frame(self, digest: Optional[str]):
+        data = self.get(digest)
+        if data is None:
+            return None
+        return pd.read_pickle(io.BytesIO(data))
+
+    def _touch(self, path: str) -> None:
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def written(self, num_bytes: int) -> None:
+        """Count bytes added to the store, evicting when due"""
+        with self._lock:
+            self._written += num_bytes
+            due = (self._written * 10 >= self.max_bytes
+                   or time.time() - self._last_evict >= BLOB_STORE_EVICT_INTERVAL_SECONDS)
+        if due:
+            self.evict()
+
+    def evict(self) -> None:
+        """Drop expired blobs, then the least recently used until under max_bytes"""
+        with self._lock:
+            now = time.time()
+            self._last_evict = now
+            self._written = 0
+            entries = []
+            for dirpath, _, filenames in os.walk(self.root):
+                if dirpath == self.root:
+                    continue  # blobs only live in the shard subdirectories
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    if now - st.st_mtime > self.ttl_seconds:
+                        self._remove(path)
+                    else:
+                        entries.append((st.st_mtime, st.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+@process_wide
+def get_blob_store() -> BlobStore:
+    """The store under BLOB_STORE_DIR used by every session and job"""
+    return BlobStore()
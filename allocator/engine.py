@@ -0,0 +1,279 @@
+import os
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from allocator.mapping import DEFAULT_COST_TO
+from allocator.rules import load_rules, usage_column, user_arrays
+
+ALLOCATION_ID_COLUMNS = ['User name', 'Email', 'Cost To']
+# Users per densified block when exporting the full allocation
+EXPORT_CHUNK_ROWS = int(os.environ.get("ALLOCATION_EXPORT_CHUNK_ROWS", 50_000))
+
+
+def load_users(csv_source) -> pd.DataFrame:
+    """Read the users CSV export and normalise emails and user names"""
+    users_df = pd.read_csv(csv_source)
+    users_df['email'] = users_df['email'].str.lower()
+    if 'User name' not in users_df.columns:
+        users_df['User name'] = users_df.get('username', users_df.get('name', ''))
+    return users_df
+
+
+def split_cents(weights: np.ndarray, amounts: np.ndarray) -> np.ndarray:
+    """Split each product amount across users by weight, exactly, in integer cents
+
+    Every user gets the floor of their exact share; the leftover cents of a
+    product go one each to the users with the largest remainders (ties to
+    the earlier row), so columns always sum to the invoice amount.
+    """
+    totals = np.round(np.asarray(amounts, dtype=float) * 100).astype(np.int64)
+    exact = weights * totals
+    cents = np.floor(exact + 1e-9).astype(np.int64)
+    leftover = np.where(weights.sum(axis=0) > 0, totals - cents.sum(axis=0), 0)
+    if leftover.any():
+        order = np.argsort(-(exact - cents), axis=0, kind="stable")
+        ranks = np.empty_like(order)
+        np.put_along_axis(ranks, order, np.arange(len(weights))[:, None].repeat(weights.shape[1], axis=1), axis=0)
+        cents += (ranks < leftover).astype(np.int64)
+    return cents
+
+
+def product_charges(product_names: List[str], amounts: List[float], cost_to: pd.Series, emails: pd.Series,
+                    rules=None, usage: Optional[pd.DataFrame] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Split every product per its rule into (user index, product index, cents) triplets
+
+    Products are split one at a time over just their eligible users, so no
+    dense users x products matrix is ever built and users who don't pay
+    for a product get no entry for it.
+    """
+    rules = load_rules() if rules is None else rules
+    arrays = user_arrays(cost_to, emails)
+    n = len(arrays[1])
+    user_idx, product_idx, cents = [], [], []
+    for j, (name, amount) in enumerate(zip(product_names, amounts)):
+        rule = rules.get(name)
+        if rule is not None and rule.bu_percentages is not None:
+            # Per-BU percentage rules are apportioned to BUs first so each BU total is exact
+            column = rule.bu_cents(int(round(amount * 100)), *arrays, usage_column(usage, name))
+            idx = np.flatnonzero(column)
+            column = column[idx]
+        else:
+            weights = np.full(n, 1.0 / n) if rule is None else rule.weights(*arrays, usage_column(usage, name))
+            idx = np.flatnonzero(weights)
+            column = split_cents(weights[idx, None], [amount])[:, 0]
+            idx, column = idx[column != 0], column[column != 0]
+        user_idx.append(idx)
+        product_idx.append(np.full(len(idx), j, dtype=np.int16))
+        cents.append(column)
+    return (np.concatenate(user_idx).astype(np.int32) if user_idx else np.zeros(0, dtype=np.int32),
+            np.concatenate(product_idx) if product_idx else np.zeros(0, dtype=np.int16),
+            np.concatenate(cents) if cents else np.zeros(0, dtype=np.int64))
+
+
+def summarize_cents(cost_to: pd.Series, user_idx: np.ndarray, product_idx: np.ndarray, cents: np.ndarray,
+                    product_names: List[str]) -> pd.DataFrame:
+    """BU x product totals from sparse charges
+
+    BUs are dictionary-encoded to integer codes and the whole BU x product
+    table is one weighted bincount over (BU code, product) cells; labels
+    are attached only at the end.
+    """
+    return _summary_frame(_bu_cents(cost_to, user_idx, product_idx, cents, product_names), product_names)
+
+
+def _bu_cents(cost_to: pd.Series, user_idx: np.ndarray, product_idx: np.ndarray, cents: np.ndarray,
+              product_names: List[str]) -> pd.DataFrame:
+    """BU x product totals in integer cents, indexed by Cost To"""
+    codes, labels = pd.factorize(cost_to, sort=True)
+    num_products = len(product_names)
+    totals = np.bincount(
+        codes[user_idx].astype(np.int64) * num_products + product_idx, weights=cents,
+        minlength=len(labels) * num_products,
+    ).round().astype(np.int64).reshape(len(labels), num_products)
+    return pd.DataFrame(totals, index=pd.Index(labels, name="Cost To"), columns=product_names)
+
+
+def _summary_frame(totals: pd.DataFrame, product_names: List[str]) -> pd.DataFrame:
+    """Summary table in currency units from BU x product cents"""
+    summary = (totals[product_names] / 100).reset_index()
+    summary["Grand Total"] = totals[product_names].to_numpy().sum(axis=1) / 100
+    return summary
+
+
+class SparseAllocation:
+    """Per-user charges stored as (user index, product index, cents) triplets
+
+    With narrowly scoped products most users x products cells are zero, so
+    only the non-zero charges are kept. The familiar one-row-per-user table
+    is only built on demand: ``head`` for the preview, and the CSV/Excel
+    writers in blocks of EXPORT_CHUNK_ROWS users.
+    """
+
+    __slots__ = ("users", "product_names", "user_idx", "product_idx", "cents")
+
+    def __init__(self, users: pd.DataFrame, product_names: List[str], user_idx: np.ndarray,
+                 product_idx: np.ndarray, cents: np.ndarray):
+        self.users = users  # ALLOCATION_ID_COLUMNS, one row per user
+        self.product_names = product_names
+        self.user_idx = user_idx
+        self.product_idx = product_idx
+        self.cents = cents
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def summary(self) -> pd.DataFrame:
+        return summarize_cents(self.users["Cost To"], self.user_idx, self.product_idx, self.cents, self.product_names)
+
+    def to_frame(self, rows: Optional[slice] = None) -> pd.DataFrame:
+        """Dense allocation frame (User name, Email, Cost To, one column per product), optionally only some users"""
+        start, stop, _ = (rows or slice(None)).indices(len(self.users))
+        selected = (self.user_idx >= start) & (self.user_idx < stop)
+        return self._dense(start, stop, self.user_idx[selected], self.product_idx[selected], self.cents[selected])
+
+    def head(self, n: int = 10) -> pd.DataFrame:
+        return self.to_frame(slice(0, n))
+
+    def iter_frames(self, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+        """Dense frames for consecutive blocks of users"""
+        order = np.argsort(self.user_idx, kind="stable")
+        user_idx = self.user_idx[order]
+        for start in range(0, max(len(self.users), 1), chunk_rows):
+            stop = min(start + chunk_rows, len(self.users))
+            lo, hi = np.searchsorted(user_idx, [start, stop])
+            block = order[lo:hi]
+            yield self._dense(start, stop, self.user_idx[block], self.product_idx[block], self.cents[block])
+
+    def _dense(self, start: int, stop: int, user_idx: np.ndarray, product_idx: np.ndarray,
+               cents: np.ndarray) -> pd.DataFrame:
+        dense = np.zeros((max(stop - start, 0), len(self.product_names)))
+        dense[user_idx - start, product_idx] = cents / 100
+        output_df = self.users.iloc[start:stop].reset_index(drop=True)
+        output_df[self.product_names] = dense
+        return output_df
+
+    def write_csv(self, buf, progress: Optional[Callable[[int], None]] = None) -> None:
+        """Write all rows chunk by chunk; ``progress`` gets the rows written so far"""
+        rows = 0
+        for i, frame in enumerate(self.iter_frames()):
+            frame.to_csv(buf, index=False, header=i == 0)
+            rows += len(frame)
+            if progress is not None:
+                progress(rows)
+
+    def write_excel(self, buf, sheet_name: str = "Expense Allocation",
+                    progress: Optional[Callable[[int], None]] = None) -> None:
+        with pd.ExcelWriter(buf, engine="openpyxl") as writer:
+            row = 0
+            for frame in self.iter_frames():
+                frame.to_excel(writer, index=False, sheet_name=sheet_name, startrow=row, header=row == 0)
+                row += len(frame) + (row == 0)
+                if progress is not None:
+                    progress(row - 1)
+
+    def long_frame(self) -> pd.DataFrame:
+        """One row per non-zero charge, as stored in the allocation history"""
+        return pd.DataFrame({
+            'user_name': self.users['User name'].astype(str).to_numpy()[self.user_idx],
+            'email': self.users['Email'].to_numpy()[self.user_idx],
+            'cost_to': self.users['Cost To'].to_numpy()[self.user_idx],
+            'product': np.array(self.product_names, dtype=object)[self.product_idx],
+            'amount': self.cents / 100,
+        })
+
+
+def allocate(merged: pd.DataFrame, product_items: List[Dict],
+             usage: Optional[pd.DataFrame] = None) -> Tuple[SparseAllocation, pd.DataFrame]:
+    """Split invoice amounts across users per the allocation rules and summarise by Cost To
+
+    ``usage`` is the rows-aligned output of ``rules.usage_matrix`` for
+    products weighted by seats, usage or active days.
+    Returns the sparse per-user allocation and the BU summary frame.
+    """
+    product_names = [p['desc'] for p in product_items]
+
+    merged['Cost To'] = merged['Cost To'].fillna("")
+    users = pd.DataFrame({
+        "User name": (merged["User name_x"] if "User name_x" in merged.columns else merged["User name"]).to_numpy(),
+        "Email": merged["email"].to_numpy(),
+        "Cost To": merged["Cost To"].to_numpy(),
+    })
+    user_idx, product_idx, cents = product_charges(
+        product_names, [p['amount'] for p in product_items], users["Cost To"], users["Email"], usage=usage
+    )
+    allocation = SparseAllocation(users, product_names, user_idx, product_idx, cents)
+
+    # Summary by Cost To
+    return allocation, allocation.summary()
+
+
+def reallocate(allocation: SparseAllocation, summary: pd.DataFrame, product_items: List[Dict],
+               bu_lookup: pd.Series,
+               usage: Optional[pd.DataFrame] = None) -> Tuple[SparseAllocation, pd.DataFrame, int]:
+    """Apply changed email -> BU assignments to an existing allocation
+
+    Shares of products whose rule doesn't look at BU are unaffected, so moved
+    users keep their amounts and the summary is updated by delta. BU-based
+    products are re-split only when a move changed eligibility for them.
+
+    ``usage`` must be the same frame the allocation was computed with.
+    Returns the updated allocation and summary frames and the number of
+    users whose Cost To changed.
+    """
+    product_names = [p['desc'] for p in product_items]
+    users = allocation.users
+    new_cost_to = users["Email"].map(bu_lookup).fillna(DEFAULT_COST_TO).astype(str)
+    changed = (new_cost_to != users["Cost To"]).to_numpy()
+    num_changed = int(changed.sum())
+    if num_changed == 0:
+        return allocation, summary, 0
+
+    totals = (summary.set_index("Cost To")[product_names] * 100).round().astype(np.int64)
+    rules = load_rules()
+    old_arrays = user_arrays(users.loc[changed, "Cost To"], users.loc[changed, "Email"])
+
+    # Move the changed users' charges from their old BU to the new one
+    changed_rows = np.flatnonzero(changed)
+    position = np.full(len(users), -1)
+    position[changed_rows] = np.arange(len(changed_rows))
+    is_moved = changed[allocation.user_idx]
+    moved = (position[allocation.user_idx[is_moved]], allocation.product_idx[is_moved], allocation.cents[is_moved])
+
+    def moved_totals(cost_to):
+        return _bu_cents(cost_to, *moved, product_names)
+
+    totals = totals.sub(moved_totals(users["Cost To"].iloc[changed_rows]), fill_value=0)
+    users = users.copy()
+    users.loc[changed, "Cost To"] = new_cost_to[changed]
+    totals = totals.add(moved_totals(users["Cost To"].iloc[changed_rows]), fill_value=0)
+
+    # Re-split BU-based products whose eligible set (or BU weights) changed
+    new_arrays = user_arrays(users.loc[changed, "Cost To"], users.loc[changed, "Email"])
+    resplit = [
+        j for j, name in enumerate(product_names)
+        if name in rules and rules[name].depends_on_bu and (
+            rules[name].bu_percentages is not None
+            or (rules[name].mask(*old_arrays) != rules[name].mask(*new_arrays)).any()
+        )
+    ]
+    user_idx, product_idx, cents = allocation.user_idx, allocation.product_idx, allocation.cents
+    if resplit:
+        names = [product_names[j] for j in resplit]
+        new_user_idx, new_product_idx, new_cents = product_charges(
+            names, [product_items[j]['amount'] for j in resplit], users["Cost To"], users["Email"], rules, usage
+        )
+        new_product_idx = np.asarray(resplit, dtype=np.int16)[new_product_idx]
+        keep = ~np.isin(product_idx, resplit)
+        user_idx = np.concatenate([user_idx[keep], new_user_idx])
+        product_idx = np.concatenate([product_idx[keep], new_product_idx])
+        cents = np.concatenate([cents[keep], new_cents])
+        resplit_totals = _bu_cents(users["Cost To"], new_user_idx, new_product_idx, new_cents, product_names)[names]
+        totals = totals.reindex(totals.index.union(resplit_totals.index), fill_value=0)
+        totals[names] = resplit_totals.reindex(totals.index, fill_value=0)
+
+    # Drop BUs that no longer have any users
+    totals = totals[totals.index.isin(users["Cost To"].unique())].sort_index().round().astype(np.int64)
+    summary = _summary_frame(totals, product_names)
+    return SparseAllocation(users, product_names, user_idx, product_idx, cents), summary, num_changed
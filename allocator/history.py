@@ -0,0 +1,172 @@
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from allocator.engine import SparseAllocation
+from allocator.locks import file_lock
+
+# Parquet store of completed allocations, one directory per billing period:
+#   history/period=2025-09/invoice=IN-004-123456.parquet
+HISTORY_DIR = os.environ.get("HISTORY_DIR", "history")
+# Long format, so queries read only the columns they need whatever the products were
+HISTORY_COLUMNS = ['email', 'user_name', 'cost_to', 'product', 'amount', 'invoice_number']
+
+# Pre-aggregated BU x product x period cube, kept in step with the history so
+# dashboards never touch per-user rows
+CUBE_FILE = os.path.join(HISTORY_DIR, "cube.parquet")
+CUBE_COLUMNS = ['period', 'invoice_number', 'cost_to', 'product', 'amount', 'users']
+
+
+class HistoryOverlapError(ValueError):
+    """Saving a run would drop stored invoices that the run doesn't include"""
+
+    def __init__(self, runs: List[Tuple[str, str]], dropped: List[str]):
+        self.runs = runs  # (period, invoice_key) of the stored runs it overlaps
+        self.dropped = dropped  # invoices of those runs that would be lost
+        super().__init__(
+            f"{', '.join(key for _, key in runs)} already stored in history; replacing "
+            f"{'it' if len(runs) == 1 else 'them'} would drop {', '.join(dropped)}"
+        )
+
+
+def _partition_dir(period: str) -> str:
+    return os.path.join(HISTORY_DIR, f"period={period}")
+
+
+def list_periods() -> List[str]:
+    """Billing periods ('YYYY-MM') with stored allocations, oldest first"""
+    if not os.path.isdir(HISTORY_DIR):
+        return []
+    return sorted(
+        name.split("=", 1)[1] for name in os.listdir(HISTORY_DIR)
+        if name.startswith("period=") and os.listdir(os.path.join(HISTORY_DIR, name))
+    )
+
+
+def _invoice_path(period: str, invoice_key: str) -> str:
+    return os.path.join(_partition_dir(period), f"invoice={re.sub(r'[^A-Za-z0-9_-]', '_', invoice_key)}.parquet")
+
+
+def save_allocation(allocation: SparseAllocation, meta: Dict[str, Optional[str]], replace: bool = False) -> str:
+    """Persist a completed allocation into its billing-period partition
+
+    Invoices are keyed by ``invoice_key`` (the invoice number, or a content
+    hash for invoices without one; ``+``-joined for several invoices
+    allocated together). Re-saving an invoice overwrites its file and
+    removes every other stored run that shares an invoice with it, in any
+    period: earlier dates of it, or combined runs it is now part of. So
+    repeated, incremental, re-dated or re-combined runs never count an
+    invoice twice.
+
+    A stored run with invoices this run doesn't include (a combined run
+    when saving one of its invoices alone) is only replaced with
+    ``replace=True``; otherwise HistoryOverlapError is raised and nothing is
+    written, so those invoices' costs aren't lost unnoticed. Returns the
+    written path.
+    """
+    invoice_key = meta.get("invoice_key") or meta.get("invoice_number") or "unknown"
+    long_df = allocation.long_frame()
+    long_df['invoice_number'] = invoice_key
+
+    path = _invoice_path(meta["period"], invoice_key)
+    with _cube_lock():
+        cube = load_cube()
+        invoices = set(invoice_key.split("+"))
+        overlaps = cube['invoice_number'].map(lambda key: not invoices.isdisjoint(key.split("+")))
+        stale = cube[overlaps & ~((cube['invoice_number'] == invoice_key) & (cube['period'] == meta["period"]))]
+        runs = [tuple(run) for run in stale[['period', 'invoice_number']].drop_duplicates().itertuples(index=False)]
+        dropped = sorted({invoice for _, key in runs for invoice in key.split("+")} - invoices)
+        if dropped and not replace:
+            raise HistoryOverlapError(runs, dropped)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for period, key in runs:
+            _remove(_invoice_path(period, key))
+        tmp_path = path + ".tmp"
+        long_df[HISTORY_COLUMNS].to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        _write_cube(cube[~cube.index.isin(stale.index)], long_df, meta["period"], invoice_key)
+    return path
+
+
+def _cube_lock():
+    """Held while changing the history and cube, across the UI and API processes"""
+    return file_lock(CUBE_FILE + ".lock")
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def load_cube() -> pd.DataFrame:
+    if not os.path.exists(CUBE_FILE):
+        return pd.DataFrame(columns=CUBE_COLUMNS)
+    return pd.read_parquet(CUBE_FILE)
+
+
+def _update_cube(long_df: pd.DataFrame, period: str, invoice_number: str) -> None:
+    """Replace this invoice's slice of the cube with its new aggregate"""
+    with _cube_lock():
+        _write_cube(load_cube(), long_df, period, invoice_number)
+
+
+def _write_cube(cube: pd.DataFrame, long_df: pd.DataFrame, period: str, invoice_number: str) -> None:
+    """Write ``cube`` with this invoice's slice replaced; the caller holds _cube_lock()"""
+    cells = long_df.groupby(['cost_to', 'product'], as_index=False).agg(
+        amount=('amount', 'sum'), users=('email', 'nunique')
+    )
+    cells.insert(0, 'period', period)
+    cells.insert(1, 'invoice_number', invoice_number)
+
+    cube = cube[~((cube['period'] == period) & (cube['invoice_number'] == invoice_number))]
+    cube = pd.concat([cube, cells], ignore_index=True) if not cube.empty else cells
+    cube = cube.sort_values(['period', 'invoice_number', 'cost_to', 'product'])
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    tmp_path = CUBE_FILE + ".tmp"
+    cube[CUBE_COLUMNS].to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, CUBE_FILE)
+
+
+def rebuild_cube() -> None:
+    """Recompute the cube from every stored partition (e.g. for history saved before it existed)"""
+    df = _scan(None, None, ['email', 'cost_to', 'product', 'amount', 'invoice_number'])
+    for (period, invoice_number), part in df.groupby(['period', 'invoice_number']):
+        _update_cube(part, period, invoice_number)
+
+
+def _scan(start: Optional[str], end: Optional[str], columns: List[str], filters=None) -> pd.DataFrame:
+    """Read only the partitions within [start, end] and only the given columns"""
+    import pyarrow.parquet as pq
+
+    frames = []
+    for period in list_periods():
+        if (start and period < start) or (end and period > end):
+            continue
+        partition = _partition_dir(period)
+        for name in sorted(os.listdir(partition)):
+            if not name.endswith(".parquet"):
+                continue
+            table = pq.read_table(os.path.join(partition, name), columns=columns, filters=filters)
+            frame = table.to_pandas()
+            frame['period'] = period
+            frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=columns + ['period'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def bu_product_costs(start: Optional[str] = None, end: Optional[str] = None) -> pd.DataFrame:
+    """Total cost per BU and product over the periods in [start, end]"""
+    df = _scan(start, end, ['cost_to', 'product', 'amount'])
+    return df.groupby(['period', 'cost_to', 'product'], as_index=False)['amount'].sum()
+
+
+def user_charges(email: str, start: Optional[str] = None, end: Optional[str] = None) -> pd.DataFrame:
+    """One user's charges per period and product"""
+    df = _scan(start, end, ['email', 'cost_to', 'product', 'amount', 'invoice_number'],
+               filters=[('email', '==', email.strip().lower())])
+    return df.drop(columns=['email']).sort_values(['period', 'product']).reset_index(drop=True)
@@ -0,0 +1,388 @@
+import hashlib
+import io
+import os
+import re
+from concurrent.futures import as_completed
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional
+
+from allocator.admission import get_worker_pool
+
+# Products billed on the Atlassian invoice, with the licensed seat count
+PRODUCT_ITEMS = [
+    ("Confluence", 30),
+    ("draw.io Diagrams |", 30),
+    ("Flowchart & PlantUML", 30),
+    ("Jira Service", 14),
+    ("Jira, Standard", 52),
+    ("draw.io Diagrams for", 52),
+]
+
+# Bump when line-item parsing changes what amounts are read from an invoice
+LINE_PARSER_VERSION = 4
+
+# Changes whenever the product list above or the parser is edited, invalidating cached results
+CATALOG_VERSION = hashlib.sha256(repr((PRODUCT_ITEMS, LINE_PARSER_VERSION)).encode()).hexdigest()[:16]
+
+MONEY_RE = re.compile(r"\b([A-Z]{3})\s*([\d,]+\.\d{2})\b")
+QUANTITY_RE = re.compile(r"\b(\d[\d,]*)\s*(?:users?|agents?|seats?)\b", re.IGNORECASE)
+# Money columns of the line-item table header, in the order they appear
+HEADER_COLUMN_RE = re.compile(r"unit\s*price|amount\s*excl\.?\s*tax|amount\s*incl\.?\s*tax|\btax\b|\bamount\b", re.IGNORECASE)
+HEADER_COLUMNS = {
+    "unitprice": "unit_price",
+    "amountexcltax": "amount_excl_tax",
+    "amountincltax": "amount_incl_tax",
+    "tax": "tax",
+    "amount": "amount_incl_tax",
+}
+# Header columns that mean the table lists tax; without one a plain Amount is excl. tax
+TAX_COLUMNS = {"amount_excl_tax", "tax", "amount_incl_tax"}
+# Money columns assumed when no header row is found (current Atlassian layout)
+DEFAULT_MONEY_COLUMNS = ["unit_price", "amount_excl_tax", "tax", "amount_incl_tax"]
+# Without a header, lines with fewer amounts are read as the older layouts:
+# a lone amount or unit price + amount are both excl. tax
+HEADERLESS_MONEY_COLUMNS = {
+    1: ["amount_excl_tax"],
+    2: ["unit_price", "amount_excl_tax"],
+}
+INVOICE_NUMBER_RE = re.compile(r"Invoice\s*(?:number|no\.?|#)\s*:?\s*([A-Z0-9][A-Z0-9-]{3,})", re.IGNORECASE)
+BILLING_PERIOD_RE = re.compile(r"Billing\s*period\s*:?\s*(.+)", re.IGNORECASE)
+DATE_RE = re.compile(r"[A-Z][a-z]{2,8}\.? \d{1,2},? \d{4}|\d{1,2} [A-Z][a-z]{2,8}\.? \d{4}|\d{4}-\d{2}-\d{2}")
+DATE_FORMATS = ["%b %d %Y", "%B %d %Y", "%d %b %Y", "%d %B %Y", "%Y-%m-%d"]
+
+
+# Per-document limits; pages are processed as a stream, so memory stays
+# roughly constant in page count and only the extracted text grows
+PDF_MAX_PAGES = int(os.environ.get("PDF_MAX_PAGES", 1000))
+PDF_MAX_TEXT_CHARS = int(os.environ.get("PDF_MAX_TEXT_CHARS", 20_000_000))
+
+
+# Cheap checks run before full extraction. Longer documents get a warning,
+# and page 1 should name the vendor: PDF_HEADER_CHECK is "warn", "reject" or "off"
+PDF_WARN_PAGES = int(os.environ.get("PDF_WARN_PAGES", 50))
+PDF_HEADER_TOKENS = [t.strip().lower() for t in os.environ.get("PDF_HEADER_TOKENS", "atlassian,invoice").split(",") if t.strip()]
+PDF_HEADER_CHECK = os.environ.get("PDF_HEADER_CHECK", "warn")
+
+
+class PdfBudgetError(ValueError):
+    """Invoice exceeds the per-document page or text budget"""
+
+
+class PdfValidationError(ValueError):
+    """Upload is not a readable invoice PDF (corrupt, encrypted or not an invoice)"""
+
+
+def validate_pdf(data: bytes, name: str = "PDF") -> List[str]:
+    """Reject or warn about an upload before the expensive text extraction
+
+    Only opens the document and reads page 1's text layer. Raises
+    PdfValidationError for unreadable/encrypted files (or a missing vendor
+    header under PDF_HEADER_CHECK=reject) and PdfBudgetError above
+    PDF_MAX_PAGES; returns warnings for anything merely suspicious.
+    """
+    import pypdfium2
+    import pypdfium2.raw as pdfium_c
+
+    try:
+        pdf = pypdfium2.PdfDocument(data)
+    except pypdfium2.PdfiumError as e:
+        if e.err_code in (pdfium_c.FPDF_ERR_PASSWORD, pdfium_c.FPDF_ERR_SECURITY):
+            raise PdfValidationError(f"{name} is password protected")
+        raise PdfValidationError(f"{name} is not a readable PDF")
+
+    warnings = []
+    try:
+        num_pages = len(pdf)
+        if num_pages == 0:
+            raise PdfValidationError(f"{name} has no pages")
+        if num_pages > PDF_MAX_PAGES:
+            raise PdfBudgetError(f"{name} has {num_pages} pages, more than the limit of {PDF_MAX_PAGES}")
+        if num_pages > PDF_WARN_PAGES:
+            warnings.append(f"{name} has {num_pages} pages, unusually long for an invoice")
+
+        page = pdf[0]
+        textpage = page.get_textpage()
+        try:
+            first_page = textpage.get_text_range().lower()
+        finally:
+            textpage.close()
+            page.close()
+    finally:
+        pdf.close()
+
+    if not first_page.strip():
+        warnings.append(f"{name} has no text layer on page 1 (scanned?)")
+    elif PDF_HEADER_CHECK != "off":
+        missing = [token for token in PDF_HEADER_TOKENS if token not in first_page]
+        if missing:
+            message = f"{name} doesn't look like an Atlassian invoice (page 1 lacks: {', '.join(missing)})"
+            if PDF_HEADER_CHECK == "reject":
+                raise PdfValidationError(message)
+            warnings.append(message)
+    return warnings
+
+
+def _pypdfium2_pages(data: bytes) -> Iterator[str]:
+    """Plain text straight from PDFium's text layer - no layout analysis"""
+    import pypdfium2
+
+    pdf = pypdfium2.PdfDocument(data)
+    try:
+        for i in range(len(pdf)):
+            page = pdf[i]
+            textpage = page.get_textpage()
+            try:
+                yield textpage.get_text_range().replace('\r\n', '\n')
+            finally:
+                textpage.close()
+                page.close()
+    finally:
+        pdf.close()
+
+
+def _pdfplumber_pages(data: bytes) -> Iterator[str]:
+    """Text via pdfplumber's character-level layout analysis (slow, most robust)"""
+    # pdfplumber/pdfminer are only needed once a PDF is uploaded
+    import pdfplumber
+
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        for page in pdf.pages:
+            try:
+                yield page.extract_text() or ''
+            finally:
+                # Drop the page's parsed chars/objects now rather than at document close
+                # (Page.close() needs pdfplumber 0.10.4)
+                page.close()
+
+
+# Text extraction backends (page text generators), fastest first;
+# PDF_TEXT_BACKEND picks the one tried first
+TEXT_BACKENDS = {
+    "pypdfium2": _pypdfium2_pages,
+    "pdfplumber": _pdfplumber_pages,
+}
+PDF_TEXT_BACKEND = os.environ.get("PDF_TEXT_BACKEND", "pypdfium2")
+FALLBACK_TEXT_BACKEND = "pdfplumber"
+
+
+def _collect_text(pages: Iterator[str], progress: Optional[Callable[[int], None]] = None) -> str:
+    """Join streamed page texts, enforcing the per-document budget"""
+    parts = []
+    num_chars = 0
+    try:
+        for num_pages, page_text in enumerate(pages, 1):
+            if num_pages > PDF_MAX_PAGES:
+                raise PdfBudgetError(f"Invoice has more than {PDF_MAX_PAGES} pages")
+            if page_text:
+                parts.append(page_text + '\n')
+                num_chars += len(page_text) + 1
+            if num_chars > PDF_MAX_TEXT_CHARS:
+                raise PdfBudgetError(f"Invoice text exceeds {PDF_MAX_TEXT_CHARS:,} characters")
+            if progress is not None:
+                progress(num_pages)
+    finally:
+        pages.close()
+    return ''.join(parts)
+
+
+def has_product_lines(text: str) -> bool:
+    """At least one product line, and every product line carries an amount (in any currency)"""
+    lines = [
+        line for line in text.splitlines()
+        if any(name.lower() in line.lower() for name, _ in PRODUCT_ITEMS)
+    ]
+    return bool(lines) and all(MONEY_RE.search(line) for line in lines)
+
+
+def extract_pdf_text(pdf_source, backend: Optional[str] = None,
+                     progress: Optional[Callable[[int], None]] = None) -> str:
+    """Extract plain text from an invoice PDF (file-like object or raw bytes)
+
+    Uses the fast backend first and falls back to pdfplumber when its text
+    has no usable product lines (e.g. amounts split off their row). Raises
+    PdfBudgetError if the document exceeds PDF_MAX_PAGES/PDF_MAX_TEXT_CHARS.
+    ``progress`` is called with the number of pages read so far.
+    """
+    data = bytes(pdf_source) if isinstance(pdf_source, (bytes, bytearray)) else pdf_source.read()
+    backend = backend or PDF_TEXT_BACKEND
+    try:
+        text = _collect_text(TEXT_BACKENDS[backend](data), progress)
+    except PdfBudgetError:
+        raise
+    except Exception:
+        if backend == FALLBACK_TEXT_BACKEND:
+            raise
+        text = ''
+    if backend != FALLBACK_TEXT_BACKEND and not has_product_lines(text):
+        text = _collect_text(TEXT_BACKENDS[FALLBACK_TEXT_BACKEND](data), progress)
+    return text
+
+
+def extract_pdf_texts(pdf_sources: List[bytes], progress: Optional[Callable[[int], None]] = None) -> List[str]:
+    """Extract several invoices concurrently on the shared worker processes
+
+    ``progress`` is called with the pages read of a single invoice, or the
+    number of invoices done when there are several.
+    """
+    if len(pdf_sources) <= 1:
+        return [extract_pdf_text(source, progress=progress) for source in pdf_sources]
+    futures = [get_worker_pool().submit(extract_pdf_text, source) for source in pdf_sources]
+    try:
+        for num_done, _ in enumerate(as_completed(futures), 1):
+            if progress is not None:
+                progress(num_done)
+        return [future.result() for future in futures]
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def _parse_date(value: str) -> Optional[datetime]:
+    value = value.replace(",", "").replace(".", "")
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def extract_invoice_meta(text: str) -> Dict[str, Optional[str]]:
+    """Invoice number and billing period ('YYYY-MM' of the period start)"""
+    meta = {"invoice_number": None, "period": None, "period_start": None, "period_end": None}
+    match = INVOICE_NUMBER_RE.search(text)
+    if match:
+        meta["invoice_number"] = match.group(1)
+
+    match = BILLING_PERIOD_RE.search(text)
+    if match:
+        dates = [d for d in (_parse_date(v) for v in DATE_RE.findall(match.group(1))) if d is not None]
+        if dates:
+            meta["period_start"] = dates[0].strftime("%Y-%m-%d")
+            meta["period"] = dates[0].strftime("%Y-%m")
+        if len(dates) > 1:
+            meta["period_end"] = dates[1].strftime("%Y-%m-%d")
+    return meta
+
+
+class LineItem:
+    """One parsed invoice line with every money column, so both VAT modes come from one parse"""
+
+    __slots__ = ("description", "quantity", "unit_price", "tax", "amount_excl_tax", "amount_incl_tax", "currency")
+
+    def __init__(self, description: str, quantity: Optional[int] = None, unit_price: Optional[float] = None,
+                 tax: Optional[float] = None, amount_excl_tax: Optional[float] = None,
+                 amount_incl_tax: Optional[float] = None, currency: Optional[str] = None):
+        self.description = description
+        self.quantity = quantity
+        self.unit_price = unit_price
+        self.tax = tax
+        self.amount_excl_tax = amount_excl_tax
+        self.amount_incl_tax = amount_incl_tax
+        self.currency = currency
+
+    def amount(self, include_vat: bool) -> Optional[float]:
+        """Amount incl. or excl. tax; invoices without a tax column are the same either way"""
+        if not include_vat:
+            return self.amount_excl_tax
+        if self.amount_incl_tax is not None:
+            return self.amount_incl_tax
+        if self.amount_excl_tax is not None and self.tax is not None:
+            return round(self.amount_excl_tax + self.tax, 2)
+        return self.amount_excl_tax
+
+
+def header_money_columns(text: str) -> Optional[List[str]]:
+    """Money columns named in the line-item table header, left to right"""
+    for line in text.splitlines():
+        lower = line.lower()
+        if "description" in lower and "amount" in lower:
+            names = [re.sub(r"[\s.]", "", m.group(0).lower()) for m in HEADER_COLUMN_RE.finditer(line)]
+            columns = [HEADER_COLUMNS[name] for name in names]
+            if columns and not TAX_COLUMNS.intersection(HEADER_COLUMNS[name] for name in names if name != "amount"):
+                # A plain Amount is the final amount when tax is listed, else there's no tax on it
+                columns = ["amount_excl_tax" if name == "amount" else column for name, column in zip(names, columns)]
+            if columns:
+                return columns
+    return None
+
+
+def _parse_line(line: str, money_columns: Optional[List[str]]) -> LineItem:
+    quantity = QUANTITY_RE.search(line)
+    money = MONEY_RE.search(line)
+    # Description is everything before the quantity/money columns
+    starts = [m.start() for m in (quantity, money) if m is not None]
+    item = LineItem(line[:min(starts)].strip() if starts else line)
+    if quantity:
+        item.quantity = int(quantity.group(1).replace(',', ''))
+
+    values = MONEY_RE.findall(line)
+    if not values:
+        return item
+    item.currency = values[0][0]
+    amounts = [float(value.replace(',', '')) for _, value in values]
+    if money_columns is None:
+        money_columns = HEADERLESS_MONEY_COLUMNS.get(len(amounts), DEFAULT_MONEY_COLUMNS)
+    # Leading columns (e.g. unit price) are the ones left blank, so align from the right
+    for column, amount in zip(money_columns[-len(amounts):], amounts[-len(money_columns):]):
+        setattr(item, column, amount)
+    return item
+
+
+def parse_line_items(text: str, money_columns: Optional[List[str]] = None) -> List[Optional[LineItem]]:
+    """Parse each product's invoice line once; None for products not on the invoice
+
+    Amounts are assigned to columns by the table header (or the given
+    ``money_columns`` layout), so the same records serve both the incl. and
+    excl. VAT calculation.
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    money_columns = money_columns or header_money_columns(text)
+    items = []
+    for name, _ in PRODUCT_ITEMS:
+        line = next((line for line in lines if name.lower() in line.lower()), None)
+        items.append(None if line is None else _parse_line(line, money_columns))
+    return items
+
+
+def invoice_items(line_items: List[Optional[LineItem]], include_vat: bool = False) -> List[Dict]:
+    """Product vector (desc, amount, seat count) for one VAT mode from parsed line items"""
+    return [
+        {
+            "desc": name,
+            "amount": None if item is None else item.amount(include_vat),
+            "count": item.quantity if item is not None and item.quantity else default_count,
+        }
+        for (name, default_count), item in zip(PRODUCT_ITEMS, line_items)
+    ]
+
+
+def extract_invoice_items(text: str, include_vat: bool = False) -> List[Dict]:
+    return invoice_items(parse_line_items(text), include_vat)
+
+
+def merge_invoice_items(items_per_invoice: List[List[Dict]]) -> List[Dict]:
+    """Combine line items from several invoices into one product vector
+
+    Amounts for the same product are summed; a product stays missing (None)
+    only if no invoice had it.
+    """
+    merged = []
+    for i, (name, default_count) in enumerate(PRODUCT_ITEMS):
+        found = [items[i] for items in items_per_invoice if items[i]['amount'] is not None]
+        merged.append({
+            "desc": name,
+            "amount": round(sum(item['amount'] for item in found), 2) if found else None,
+            "count": sum(item['count'] for item in found) if found else default_count,
+        })
+    return merged
+
+
+def merge_invoice_meta(metas: List[Dict[str, Optional[str]]]) -> Dict[str, Optional[str]]:
+    """Invoice numbers and history keys of all invoices, billing period of the first that has one"""
+    numbers = [m["invoice_number"] for m in metas if m["invoice_number"]]
+    merged = next((dict(m) for m in metas if m["period"]), dict(metas[0]))
+    merged["invoice_number"] = "+".join(numbers) if numbers else None
+    keys = [m.get("invoice_key") or m["invoice_number"] for m in metas]
+    merged["invoice_key"] = "+".join(keys) if all(keys) else None
+    return merged
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+from allocator.locks import process_wide
+
+# Background jobs (invoice parsing, allocation, exports) running at once;
+# their CPU-heavy stages still queue for admission slots
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 8))
+# Finished jobs are kept this long for their session to pick up the result
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", 60 * 60))
+# Jobs are waited on this long before the UI switches to a progress bar
+JOB_INLINE_WAIT_SECONDS = float(os.environ.get("JOB_INLINE_WAIT_SECONDS", 1.0))
+
+
+class JobCancelled(BaseException):
+    """Raised inside a job once it has been cancelled
+
+    A BaseException, like asyncio.CancelledError, so ``except Exception``
+    fallbacks along the way don't swallow it.
+    """
+
+
+class Job:
+    """One background run with its progress, result or error"""
+
+    __slots__ = ("id", "kind", "user", "inputs", "status", "stage", "done", "total", "unit",
+                 "queue_position", "result", "error", "finished_at", "_cancel", "_finished")
+
+    def __init__(self, kind: str, user: str, inputs: Tuple):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.user = user
+        self.inputs = inputs
+        self.status = "queued"  # queued, running, done, failed, cancelled
+        self.stage = "Queued"
+        self.done = 0
+        self.total: Optional[int] = None
+        self.unit = ""
+        self.queue_position: Optional[int] = None
+        self.result = None
+        self.error: Optional[Exception] = None
+        self.finished_at: Optional[float] = None
+        self._cancel = threading.Event()
+        self._finished = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    @property
+    def fraction(self) -> float:
+        return min(self.done / self.total, 1.0) if self.total else 0.0
+
+    def describe(self) -> str:
+        if self.queue_position:
+            return f"{self.stage} - server busy, number {self.queue_position} in the queue"
+        if self.total:
+            return f"{self.stage} - {self.done:,} of {self.total:,} {self.unit}"
+        if self.done:
+            return f"{self.stage} - {self.done:,} {self.unit}"
+        return self.stage
+
+    def report(self, stage: Optional[str] = None, done: Optional[int] = None,
+               total: Optional[int] = None, unit: Optional[str] = None) -> None:
+        """Update progress; also the point where a cancelled job stops"""
+        self.check_cancelled()
+        if stage is not None:
+            self.stage, self.done, self.total, self.unit = stage, 0, None, ""
+        if done is not None:
+            self.done = done
+        if total is not None:
+            self.total = total
+        if unit is not None:
+            self.unit = unit
+        self.queue_position = None
+
+    def waiting(self, position: int) -> None:
+        """Admission queue callback"""
+        self.check_cancelled()
+        self.queue_position = position
+
+    def check_cancelled(self) -> None:
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the job finishes or the timeout passes; True if finished"""
+        return self._finished.wait(timeout)
+
+
+class JobManager:
+    """Runs jobs on a shared thread pool, so they outlive the script run that started them"""
+
+    def __init__(self, workers: int = JOB_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, user: str, inputs: Tuple, fn: Callable, *args) -> Job:
+        """Start ``fn(job, *args)`` in the background; its return value becomes the result"""
+        job = Job(kind, user, inputs)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._pool.submit(self._run, job, fn, args)
+        return job
+
+    def get(self, job_id: Optional[str]) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id) if job_id else None
+
+    def cancel(self, job_id: Optional[str]) -> None:
+        job = self.get(job_id)
+        if job is not None and not job.finished:
+            job.cancel()
+
+    def _run(self, job: Job, fn: Callable, args: Tuple) -> None:
+        try:
+            job.check_cancelled()
+            job.status = "running"
+            job.result = fn(job, *args)
+            job.status = "done"
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            job.error = e
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            job._finished.set()
+
+    def _prune(self) -> None:
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id in [j.id for j in self._jobs.values() if j.finished_at is not None and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+
+@process_wide
+def get_job_manager() -> JobManager:
+    """Jobs of every session (and API caller) of this process, by id"""
+    return JobManager()
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+
+from allocator.blobstore import BLOB_STORE_DIR
+from allocator.invoice import INVOICE_NUMBER_RE, LINE_PARSER_VERSION, header_money_columns
+from allocator.locks import file_lock, process_wide
+
+# Known column layouts per billing account / invoice template, so invoices
+# whose header row doesn't survive text extraction still parse correctly
+LAYOUT_CACHE_FILE = os.path.join(BLOB_STORE_DIR, "invoice_layouts.json")
+
+ACCOUNT_RE = re.compile(r"(?:Billing\s*account|Account\s*(?:number|id)|SEN)\s*:?\s*([A-Za-z0-9-]{4,})", re.IGNORECASE)
+TITLE_RE = re.compile(r"^(?:Tax\s+)?Invoice$", re.IGNORECASE)
+
+# VAT handling chosen on the upload form; "auto" follows the detected layout
+VAT_MODES = {
+    "auto": "🔎 Auto-detect",
+    "include": "Include VAT",
+    "exclude": "Exclude VAT",
+}
+
+
+def template_key(text: str) -> str:
+    """Fingerprint of the billing account and invoice template a document comes from"""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    # Layouts learned by an older parser may name the columns differently
+    parts = [str(LINE_PARSER_VERSION), lines[0] if lines else ""]
+    parts += [line.lower() for line in lines[:10] if TITLE_RE.match(line)]
+    match = ACCOUNT_RE.search(text)
+    if match:
+        parts.append(match.group(1))
+    else:
+        # Invoice numbers share a per-account prefix, e.g. IN-004-123456 -> IN-004
+        match = INVOICE_NUMBER_RE.search(text)
+        if match:
+            parts.append(match.group(1).rsplit("-", 1)[0])
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()[:16]
+
+
+class LayoutCache:
+    """Template fingerprint -> money columns of its line-item table"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._layouts: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self._layouts = json.load(f)
+
+    def get(self, key: str) -> Optional[List[str]]:
+        with self._lock:
+            if key not in self._layouts and self.path and os.path.exists(self.path):
+                # Another process may have learned it
+                with open(self.path) as f:
+                    self._layouts.update(json.load(f))
+            return self._layouts.get(key)
+
+    def put(self, key: str, money_columns: List[str]) -> None:
+        with self._lock:
+            if self._layouts.get(key) == money_columns:
+                return
+            self._layouts[key] = money_columns
+            if self.path:
+                # Merge with layouts other processes have saved since
+                with file_lock(self.path + ".lock"):
+                    if os.path.exists(self.path):
+                        with open(self.path) as f:
+                            self._layouts = dict(json.load(f), **{key: money_columns})
+                    tmp_path = self.path + ".tmp"
+                    with open(tmp_path, "w") as f:
+                        json.dump(self._layouts, f)
+                    os.replace(tmp_path, self.path)
+
+
+@process_wide
+def get_layout_cache() -> LayoutCache:
+    """Layouts learned from any invoice, kept in LAYOUT_CACHE_FILE"""
+    os.makedirs(BLOB_STORE_DIR, exist_ok=True)
+    return LayoutCache(LAYOUT_CACHE_FILE)
+
+
+def detect_layout(text: str) -> Dict:
+    """Money columns of an invoice and whether it carries VAT
+
+    The header row decides and is remembered for the invoice's template;
+    without one the template's remembered layout is used. Returns
+    ``money_columns`` (None if unknown), ``has_vat`` and ``source``
+    ("header", "template" or "unknown").
+    """
+    key = template_key(text)
+    money_columns = header_money_columns(text)
+    if money_columns is not None:
+        get_layout_cache().put(key, money_columns)
+        source = "header"
+    else:
+        money_columns = get_layout_cache().get(key)
+        source = "template" if money_columns is not None else "unknown"
+    has_vat = money_columns is not None and ("amount_incl_tax" in money_columns or "tax" in money_columns)
+    return {"money_columns": money_columns, "has_vat": has_vat, "source": source}
+
+
+def resolve_include_vat(vat_mode: str, layout: Dict) -> bool:
+    """Whether to use amounts incl. VAT for an invoice under the chosen mode"""
+    if vat_mode == "auto":
+        return layout["has_vat"]
+    return vat_mode == "include"
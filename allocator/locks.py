@@ -0,0 +1,59 @@
+import functools
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, TypeVar
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of this process are serialised
+    fcntl = None
+
+# Threads of this process queue on a thread lock per file first, which is
+# all there is without fcntl
+_thread_locks: Dict[str, threading.Lock] = {}
+_thread_locks_lock = threading.Lock()
+
+T = TypeVar("T")
+
+
+@contextmanager
+def file_lock(path: str):
+    """Exclusive lock on ``path`` shared by every process on the host (the UI and the API)
+
+    Held around read-modify-write of shared files such as the BU mapping,
+    so concurrent writers don't lose each other's changes.
+    """
+    with _thread_locks_lock:
+        thread_lock = _thread_locks.setdefault(os.path.abspath(path), threading.Lock())
+    with thread_lock:
+        if fcntl is None:
+            yield
+            return
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+
+def process_wide(factory: Callable[[], T]) -> Callable[[], T]:
+    """Decorator for a no-argument factory whose result is shared by the whole process
+
+    The factory runs once, on first use; concurrent first calls wait for it
+    rather than each building their own instance.
+    """
+    cached = functools.lru_cache(maxsize=None)(factory)
+    lock = threading.Lock()
+
+    @functools.wraps(factory)
+    def get() -> T:
+        with lock:
+            return cached()
+    get.cache_clear = cached.cache_clear
+    return get
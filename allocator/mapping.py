@@ -0,0 +1,145 @@
+import hashlib
+import os
+import tempfile
+from typing import Optional, Tuple
+
+import pandas as pd
+
+from allocator.locks import file_lock
+
+PERSIST_FILE = "bu_mapping_current.xlsx"
+COLUMNS = ['User name', 'Email', 'Cost To']
+DEFAULT_COST_TO = "Unknown"
+
+
+class MappingChangedError(ValueError):
+    """The mapping file was saved by someone else since the caller loaded it"""
+
+
+# (mtime_ns, size) -> version of the mapping file last hashed
+_version_cache: Optional[Tuple[Tuple[int, int], str]] = None
+
+
+def load_bu_mapping() -> pd.DataFrame:
+    """Load the persisted BU mapping, creating any missing columns"""
+    if os.path.exists(PERSIST_FILE):
+        bu_df = pd.read_excel(PERSIST_FILE)
+        for col in COLUMNS:
+            if col not in bu_df.columns:
+                bu_df[col] = ""
+        return bu_df[COLUMNS]
+    return pd.DataFrame(columns=COLUMNS)
+
+
+def save_bu_mapping(df: pd.DataFrame) -> None:
+    """Persist the BU mapping to PERSIST_FILE and bump the mapping version
+
+    The file is replaced atomically, so readers in other processes never
+    see a half-written workbook. Read-modify-write callers hold
+    mapping_lock() around the load and the save.
+    """
+    global _version_cache
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(PERSIST_FILE)), suffix=".xlsx")
+    os.close(fd)
+    try:
+        df.to_excel(tmp_path, index=False)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, PERSIST_FILE)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    _version_cache = None
+
+
+def mapping_lock():
+    """Lock held while reading, changing and saving the mapping, across the UI and API processes"""
+    return file_lock(PERSIST_FILE + ".lock")
+
+
+def replace_bu_mapping(df: pd.DataFrame, loaded_stamp: Optional[Tuple[int, int]]) -> None:
+    """Save a whole mapping edited from the file as it was at ``loaded_stamp``
+
+    Raises MappingChangedError, without saving, if the file was saved since
+    (by the API, an allocation auto-adding users or another session), as
+    writing ``df`` would silently revert those changes.
+    """
+    with mapping_lock():
+        if mapping_stamp() != loaded_stamp:
+            raise MappingChangedError(
+                "The BU mapping was changed elsewhere since it was loaded; reload it and make your changes again"
+            )
+        save_bu_mapping(df)
+
+
+def mapping_stamp() -> Optional[Tuple[int, int]]:
+    """(mtime_ns, size) of the mapping file, which changes on every save; None without one"""
+    if not os.path.exists(PERSIST_FILE):
+        return None
+    stat = os.stat(PERSIST_FILE)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def mapping_version() -> str:
+    """Hash of the email -> Cost To assignments, used to key cached results
+
+    Only the assignments count: the workbook's bytes change on every save
+    (openpyxl stamps the time), and row order, email case and user names
+    don't change an allocation. The hash is only recomputed when the file
+    changes, so edits made outside the app also produce a new version.
+    """
+    global _version_cache
+    file_key = mapping_stamp()
+    if file_key is None:
+        return "empty"
+    if _version_cache is None or _version_cache[0] != file_key:
+        lookup = load_bu_lookup().astype(str).sort_index()
+        content = "\n".join(f"{email}\t{cost_to}" for email, cost_to in lookup.items())
+        _version_cache = (file_key, hashlib.sha256(content.encode()).hexdigest()[:16])
+    return _version_cache[1]
+
+
+def load_bu_lookup() -> pd.Series:
+    """Current email -> Cost To assignments (emails lower-cased, last row wins)"""
+    bu_df = load_bu_mapping()
+    emails = bu_df['Email'].astype(str).str.lower()
+    return pd.Series(bu_df['Cost To'].to_numpy(), index=emails)[~emails.duplicated(keep="last").to_numpy()]
+
+
+def merge_users_with_mapping(users_df: pd.DataFrame) -> Tuple[pd.DataFrame, int]:
+    """Join users to their BU, auto-adding unmapped emails as DEFAULT_COST_TO
+
+    Returns the merged frame and the number of users that were auto-added.
+    """
+    with mapping_lock():
+        return _merge_users_with_mapping(users_df)
+
+
+def _merge_users_with_mapping(users_df: pd.DataFrame) -> Tuple[pd.DataFrame, int]:
+    if os.path.exists(PERSIST_FILE):
+        bu_df = pd.read_excel(PERSIST_FILE)
+        bu_df['Email'] = bu_df['Email'].str.lower()
+    else:
+        bu_df = pd.DataFrame(columns=COLUMNS)
+
+    # Find and auto-add unmapped users
+    merged = pd.merge(users_df, bu_df, left_on='email', right_on='Email', how='left')
+    unmapped = merged[merged['Cost To'].isna()]
+    if len(unmapped) == 0:
+        return merged, 0
+
+    auto_added = []
+    for idx, row in unmapped.iterrows():
+        auto_added.append({
+            "User name": row.get("User name", ""),
+            "Email": row["email"],
+            "Cost To": DEFAULT_COST_TO,
+        })
+
+    # Update mapping and save
+    new_bu_df = pd.concat([bu_df, pd.DataFrame(auto_added)], ignore_index=True)
+    new_bu_df = new_bu_df.drop_duplicates(subset=["Email"], keep="last")
+    save_bu_mapping(new_bu_df)
+
+    # Re-merge with updated mapping
+    merged = pd.merge(users_df, new_bu_df, left_on='email', right_on='Email', how='left')
+    return merged, len(auto_added)
@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from allocator.blobstore import BLOB_STORE_DIR, get_blob_store
+from allocator.invoice import CATALOG_VERSION
+from allocator.locks import file_lock, process_wide
+from allocator.mapping import mapping_version
+from allocator.rules import rules_version
+
+# Max number of distinct input combinations remembered per process
+ALLOCATION_MEMO_SIZE = int(os.environ.get("ALLOCATION_MEMO_SIZE", 128))
+# Set to 1 to keep the memo index on disk, so it survives restarts and is
+# shared with other processes on the host (e.g. the UI and the HTTP API)
+ALLOCATION_MEMO_PERSIST = os.environ.get("ALLOCATION_MEMO_PERSIST", "0") == "1"
+ALLOCATION_MEMO_FILE = os.path.join(BLOB_STORE_DIR, "allocation_memo.json")
+# Bumped when the stored result objects change shape, so persisted entries
+# from older versions are never served
+RESULT_FORMAT = "sparse-1"
+
+
+def allocation_key(pdf_hashes: List[str], users_hash: str, vat_mode: str) -> str:
+    """Fingerprint of every input an allocation result depends on"""
+    return "|".join([
+        "+".join(sorted(pdf_hashes)),
+        users_hash,
+        mapping_version(),
+        vat_mode,
+        CATALOG_VERSION,
+        rules_version(),
+        RESULT_FORMAT,
+    ])
+
+
+class ResultMemo:
+    """Process-wide LRU of allocation inputs -> result entry
+
+    An entry is a small JSON-able dict; its ``*_hash`` values point at frames
+    in the blob store, and a hit is only served while all of them are present.
+    With a ``path`` the index file is shared: a miss re-reads it if another
+    process has written since, and puts merge into it under a file lock.
+    """
+
+    def __init__(self, max_entries: int = ALLOCATION_MEMO_SIZE, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.path = path
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._file_version = None
+        if path:
+            self._reload()
+
+    def get(self, key: str) -> Optional[Dict]:
+        blob_store = get_blob_store()
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None and self._reload():
+                value = self._entries.get(key)
+            if value is None:
+                return None
+            if not all(blob_store.exists(digest) for name, digest in value.items()
+                       if name.endswith("_hash") and digest is not None):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Dict) -> None:
+        with self._lock:
+            if not self.path:
+                self._add(key, value)
+                return
+            with file_lock(self.path + ".lock"):
+                self._reload()
+                self._add(key, value)
+                self._save()
+
+    def _add(self, key: str, value: Dict) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _reload(self) -> bool:
+        """Merge in the index file if it changed since last read; True if it did"""
+        try:
+            stat = os.stat(self.path) if self.path else None
+        except FileNotFoundError:
+            stat = None
+        version = (stat.st_mtime_ns, stat.st_size) if stat else None
+        if version is None or version == self._file_version:
+            return False
+        with open(self.path) as f:
+            stored = OrderedDict(json.load(f))
+        self._file_version = version
+        # Entries only this process has seen stay, as the most recent
+        local = [(k, v) for k, v in self._entries.items() if k not in stored]
+        self._entries = stored
+        for key, value in local:
+            self._add(key, value)
+        return True
+
+    def _save(self) -> None:
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(list(self._entries.items()), f)
+        os.replace(tmp_path, self.path)
+        stat = os.stat(self.path)
+        self._file_version = (stat.st_mtime_ns, stat.st_size)
+
+
+@process_wide
+def get_result_memo() -> ResultMemo:
+    """The memo consulted before every allocation, persisted if ALLOCATION_MEMO_PERSIST"""
+    get_blob_store()  # make sure BLOB_STORE_DIR exists for the index file
+    return ResultMemo(path=ALLOCATION_MEMO_FILE if ALLOCATION_MEMO_PERSIST else None)
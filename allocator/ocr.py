@@ -0,0 +1,124 @@
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from allocator.blobstore import BLOB_STORE_DIR, get_blob_store
+from allocator.locks import process_wide
+
+# OCR fallback for scanned invoices, using a local Tesseract binary.
+# PDF_OCR is "auto" (on when the binary is found), "1" or "0"
+PDF_OCR = os.environ.get("PDF_OCR", "auto")
+TESSERACT_CMD = os.environ.get("TESSERACT_CMD", "tesseract")
+# Max Tesseract processes running at once, across all sessions
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", 2))
+OCR_DPI = int(os.environ.get("OCR_DPI", 300))
+OCR_PAGE_TIMEOUT_SECONDS = int(os.environ.get("OCR_PAGE_TIMEOUT_SECONDS", 120))
+# OCR text per rendered page image; lives under the blob store, so it is
+# evicted with the same TTL/size policy
+OCR_CACHE_DIR = os.path.join(BLOB_STORE_DIR, "ocr")
+
+# Page hash -> pending OCR, so identical pages are only read once at a time
+_in_flight: Dict[str, Future] = {}
+_in_flight_lock = threading.Lock()
+
+
+def ocr_available() -> bool:
+    if PDF_OCR == "0":
+        return False
+    return shutil.which(TESSERACT_CMD) is not None
+
+
+@process_wide
+def get_ocr_pool() -> ThreadPoolExecutor:
+    """Shared pool; each worker drives one Tesseract subprocess at a time"""
+    return ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="ocr")
+
+
+def _cache_path(page_hash: str) -> str:
+    return os.path.join(OCR_CACHE_DIR, page_hash[:2], page_hash + ".txt")
+
+
+def _cached_text(page_hash: str) -> Optional[str]:
+    path = _cache_path(page_hash)
+    try:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+    except FileNotFoundError:
+        return None
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+    return text
+
+
+def _ocr_image(png: bytes, page_hash: str) -> str:
+    """Run Tesseract on one page image and cache its text"""
+    result = subprocess.run(
+        [TESSERACT_CMD, "stdin", "stdout", "--dpi", str(OCR_DPI), "--psm", "6"],
+        input=png, capture_output=True, timeout=OCR_PAGE_TIMEOUT_SECONDS, check=True,
+    )
+    text = result.stdout.decode("utf-8", errors="replace")
+    path = _cache_path(page_hash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    get_blob_store().written(len(text))
+    return text
+
+
+def _ocr_page(png: bytes):
+    """Cached text of a page image, or the pending OCR of it"""
+    page_hash = hashlib.sha256(png).hexdigest()
+    cached = _cached_text(page_hash)
+    if cached is not None:
+        return cached
+    with _in_flight_lock:
+        future = _in_flight.get(page_hash)
+        if future is None:
+            future = get_ocr_pool().submit(_ocr_image, png, page_hash)
+            _in_flight[page_hash] = future
+            future.add_done_callback(lambda _: _in_flight.pop(page_hash, None))
+    return future
+
+
+def ocr_pdf_text(data: bytes) -> str:
+    """Document text with pages lacking a text layer read by OCR
+
+    Pages that have text keep it; image-only pages are rendered and queued
+    on the shared pool, and pages seen before (same rendered image) come
+    from the cache. Only this session waits on its pages. Raises
+    ValueError if Tesseract fails or times out.
+    """
+    import pypdfium2
+
+    pages: List = []
+    pdf = pypdfium2.PdfDocument(data)
+    try:
+        for i in range(len(pdf)):
+            page = pdf[i]
+            textpage = page.get_textpage()
+            try:
+                text = textpage.get_text_range().replace('\r\n', '\n')
+                if text.strip():
+                    pages.append(text)
+                    continue
+                buf = io.BytesIO()
+                page.render(scale=OCR_DPI / 72, grayscale=True).to_pil().save(buf, format="PNG")
+            finally:
+                textpage.close()
+                page.close()
+            pages.append(_ocr_page(buf.getvalue()))
+    finally:
+        pdf.close()
+    try:
+        return '\n'.join(page if isinstance(page, str) else page.result() for page in pages)
+    except (OSError, subprocess.SubprocessError) as e:
+        raise ValueError(f"OCR failed: {e}")
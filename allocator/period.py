@@ -0,0 +1,104 @@
+import os
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from allocator.mapping import load_bu_lookup, merge_users_with_mapping
+
+# Normalised users and BU assignments of each billing period's allocation:
+#   periods/period=2025-09/users.pkl
+PERIOD_SNAPSHOT_DIR = os.environ.get("PERIOD_SNAPSHOT_DIR", "periods")
+
+CHANGE_COLUMNS = ['Email', 'User name', 'Change', 'Previous Cost To', 'Cost To']
+
+
+def _snapshot_path(period: str) -> str:
+    return os.path.join(PERIOD_SNAPSHOT_DIR, f"period={period}", "users.pkl")
+
+
+def snapshot_periods() -> List[str]:
+    """Billing periods ('YYYY-MM') with a saved snapshot, oldest first"""
+    if not os.path.isdir(PERIOD_SNAPSHOT_DIR):
+        return []
+    return sorted(
+        name.split("=", 1)[1] for name in os.listdir(PERIOD_SNAPSHOT_DIR)
+        if name.startswith("period=") and os.path.exists(os.path.join(PERIOD_SNAPSHOT_DIR, name, "users.pkl"))
+    )
+
+
+def load_previous_period(period: Optional[str]) -> Optional[Dict]:
+    """Snapshot of the latest period before ``period``, or None if there is none
+
+    Re-running (or backfilling) a period never compares it against itself
+    or a later month.
+    """
+    earlier = [p for p in snapshot_periods() if period is None or p < period]
+    if not earlier:
+        return None
+    return pd.read_pickle(_snapshot_path(earlier[-1]))
+
+
+def save_period(merged: pd.DataFrame, period: str) -> None:
+    """Remember this period's users and BU assignments, replacing an earlier run of the same period"""
+    users = merged[['email', 'User name', 'Cost To']].drop_duplicates('email', keep='last')
+    path = _snapshot_path(period)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    pd.to_pickle({"period": period, "users": users.reset_index(drop=True)}, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def merge_users_with_previous(users_df: pd.DataFrame,
+                              previous: Optional[Dict]) -> Tuple[pd.DataFrame, int, pd.DataFrame]:
+    """Join users to their BU as a delta against the previous period
+
+    Users seen last period take their current mapping row, so only rows
+    edited since then move anyone, whatever else changed in the mapping;
+    only joiners (and users dropped from the mapping) go through the
+    mapping merge and auto-add. Returns the merged frame, the number of
+    auto-added users and the change report (joiners, leavers, BU moves).
+    """
+    merged = users_df.copy()
+    if previous is None:
+        prev_users = pd.DataFrame(columns=['User name', 'Cost To'], index=pd.Index([], name='email'))
+        merged['Cost To'] = None
+    else:
+        prev_users = previous["users"].set_index('email')
+        merged['Cost To'] = merged['email'].map(load_bu_lookup())
+
+    # Joiners, and anyone dropped from the mapping since, get the full treatment
+    is_new = ~merged['email'].isin(prev_users.index)
+    needs_lookup = (is_new | merged['Cost To'].isna()).to_numpy()
+    num_auto_added = 0
+    if needs_lookup.any():
+        looked_up, num_auto_added = merge_users_with_mapping(users_df[needs_lookup])
+        lookup = looked_up.drop_duplicates('email', keep='last').set_index('email')['Cost To']
+        merged.loc[needs_lookup, 'Cost To'] = merged.loc[needs_lookup, 'email'].map(lookup).to_numpy()
+
+    if previous is None:
+        return merged, num_auto_added, pd.DataFrame(columns=CHANGE_COLUMNS)
+    return merged, num_auto_added, period_changes(prev_users, merged, is_new.to_numpy())
+
+
+def period_changes(prev_users: pd.DataFrame, merged: pd.DataFrame, is_new) -> pd.DataFrame:
+    """Joiners, leavers and BU moves relative to the previous period"""
+    joined = merged.loc[is_new]
+    stayed = merged.loc[~is_new]
+    prev_cost_to = stayed['email'].map(prev_users['Cost To'])
+    moved = stayed[(prev_cost_to != stayed['Cost To']).to_numpy()]
+    left = prev_users[~prev_users.index.isin(merged['email'])]
+
+    return pd.concat([
+        pd.DataFrame({
+            'Email': joined['email'], 'User name': joined['User name'], 'Change': "Joined",
+            'Previous Cost To': "", 'Cost To': joined['Cost To'],
+        }),
+        pd.DataFrame({
+            'Email': left.index, 'User name': left['User name'].to_numpy(), 'Change': "Left",
+            'Previous Cost To': left['Cost To'].to_numpy(), 'Cost To': "",
+        }),
+        pd.DataFrame({
+            'Email': moved['email'], 'User name': moved['User name'], 'Change': "Moved",
+            'Previous Cost To': moved['email'].map(prev_users['Cost To']), 'Cost To': moved['Cost To'],
+        }),
+    ], ignore_index=True)[CHANGE_COLUMNS]
@@ -0,0 +1,244 @@
+import io
+from datetime import date
+from typing import Dict, List, Optional
+
+from allocator.admission import get_admission_queue, run_in_worker
+from allocator.billing_export import is_billing_export, parse_billing_export
+from allocator.blobstore import get_blob_store
+from allocator.engine import SparseAllocation, allocate, load_users
+from allocator.history import HistoryOverlapError, save_allocation
+from allocator.invoice import (
+    extract_invoice_meta,
+    extract_pdf_texts,
+    has_product_lines,
+    invoice_items,
+    merge_invoice_items,
+    merge_invoice_meta,
+    parse_line_items,
+    validate_pdf,
+)
+from allocator.jobs import Job
+from allocator.layout import detect_layout, resolve_include_vat
+from allocator.mapping import mapping_version
+from allocator.memo import allocation_key, get_result_memo
+from allocator.ocr import ocr_available, ocr_pdf_text
+from allocator.period import load_previous_period, merge_users_with_previous, save_period
+from allocator.rules import usage_matrix
+
+# Background job bodies: each takes the Job first, reports progress through
+# it and returns a small dict of results (large objects go to the blob store)
+
+
+def parse_invoices(job: Job, names: List[str], digests: List[str]) -> Dict:
+    """Read uploaded invoices / billing exports into line items, layouts and meta
+
+    Raises PdfValidationError/PdfBudgetError for unusable PDFs and
+    ValueError for unreadable exports.
+    """
+    blob_store = get_blob_store()
+    sources = [blob_store.get(digest) for digest in digests]
+    if any(data is None for data in sources):
+        raise ValueError("Uploaded invoice has expired from the server cache; please upload it again")
+
+    # Cheap checks first, so wrong or oversized files fail before extraction
+    job.report("Checking invoices")
+    warnings = []
+    for name, data in zip(names, sources):
+        if not is_billing_export(data):
+            warnings += validate_pdf(data, name)
+
+    # Billing exports map straight to line items; PDFs are parsed concurrently
+    pdf_sources = [data for data in sources if not is_billing_export(data)]
+    pdf_texts = []
+    if pdf_sources:
+        job.report("Waiting to extract text")
+        with get_admission_queue().slot(job.user, "PDF extraction", len(pdf_sources), job.waiting):
+            if len(pdf_sources) == 1:
+                job.report("Extracting text", unit="pages")
+            else:
+                job.report("Extracting text", total=len(pdf_sources), unit="invoices")
+            pdf_texts = extract_pdf_texts(pdf_sources, progress=lambda done: job.report(done=done))
+
+    # Scanned invoices: OCR the pages without a text layer
+    scanned = [i for i, text in enumerate(pdf_texts) if not has_product_lines(text)]
+    if scanned and ocr_available():
+        job.report("Running OCR on scanned invoices", total=len(scanned), unit="invoices")
+        for num_done, i in enumerate(scanned, 1):
+            try:
+                pdf_texts[i] = ocr_pdf_text(pdf_sources[i])
+            except ValueError as e:
+                warnings.append(f"{e}; please enter the amounts manually")
+            job.report(done=num_done)
+
+    job.report("Parsing invoice lines")
+    pdf_texts = iter(pdf_texts)
+    texts, layouts, line_items, metas = [], [], [], []
+    for name, digest, data in zip(names, digests, sources):
+        if is_billing_export(data):
+            try:
+                items, meta, layout = parse_billing_export(data)
+            except ValueError as e:
+                raise ValueError(f"Could not read billing export {name}: {e}")
+            texts.append(data.decode("utf-8-sig", errors="replace"))
+        else:
+            # Each invoice line is parsed once into records holding both VAT
+            # modes, using the column layout detected from its header or template
+            invoice_text = next(pdf_texts)
+            layout = detect_layout(invoice_text)
+            items = parse_line_items(invoice_text, layout['money_columns'])
+            meta = extract_invoice_meta(invoice_text)
+            texts.append(invoice_text)
+        # History key: the invoice number, or the file's content hash without one
+        meta["invoice_key"] = meta["invoice_number"] or f"unknown-{digest[:12]}"
+        layouts.append(layout)
+        line_items.append(items)
+        metas.append(meta)
+    return {"texts": texts, "layouts": layouts, "line_items": line_items, "metas": metas, "warnings": warnings}
+
+
+def allocate_invoice(job: Job, users_hash: str, product_items: List[Dict], invoice_meta: Dict,
+                     replace_history: bool = False) -> Dict:
+    """Join the users with the BU mapping, split the invoice and save the results
+
+    Returns blob store digests of the allocation, summary, usage and
+    period changes, the BU mapping version used, and why the history
+    wasn't saved (``history_overlap``, None if it was): a stored run with
+    other invoices is only replaced with ``replace_history``. Raises
+    ValueError if a rule's usage column is missing.
+    """
+    blob_store = get_blob_store()
+    job.report("Reading users")
+    users_csv = blob_store.get(users_hash)
+    if users_csv is None:
+        raise ValueError("Uploaded users CSV has expired from the server cache; please upload it again")
+    users_df = load_users(io.BytesIO(users_csv))
+
+    # Current BU mapping as a delta against the previous period, auto-adding unmapped joiners
+    job.report("Joining users with the BU mapping", total=len(users_df), unit="users")
+    merged, num_auto_added, changes = merge_users_with_previous(
+        users_df, load_previous_period(invoice_meta['period']))
+    # Mapping edits made from here on are applied afterwards by re-allocation
+    version = mapping_version()
+    job.report(done=len(users_df))
+
+    # Seats, usage or active days for products whose rule weights by them
+    try:
+        usage = usage_matrix([p['desc'] for p in product_items], merged,
+                             invoice_meta['period_start'], invoice_meta['period_end'])
+    except ValueError as e:
+        raise ValueError(f"{e}. Add the column to the users CSV or change allocation_rules.json.")
+
+    job.report("Waiting to allocate")
+    with get_admission_queue().slot(job.user, "allocation", on_wait=job.waiting):
+        job.report("Allocating", total=len(merged), unit="users")
+        allocation, summary = run_in_worker(allocate, merged, product_items, usage, on_poll=job.check_cancelled)
+    # Last point to stop: after this the period and history are written
+    job.report("Saving results")
+    save_period(merged, invoice_meta['period'])
+    try:
+        save_allocation(allocation, invoice_meta, replace=replace_history)
+        history_overlap = None
+    except HistoryOverlapError as e:
+        history_overlap = str(e)
+    return {
+        "allocation_hash": blob_store.put_frame(allocation),
+        "summary_hash": blob_store.put_frame(summary),
+        "usage_hash": blob_store.put_frame(usage) if usage is not None else None,
+        "changes_hash": blob_store.put_frame(changes),
+        "num_auto_added": num_auto_added,
+        "mapping_version": version,
+        "history_overlap": history_overlap,
+    }
+
+
+def run_allocation(job: Job, names: List[str], digests: List[str], users_hash: str, vat_mode: str,
+                   amounts: Optional[Dict[str, float]] = None, period: Optional[str] = None,
+                   replace_history: bool = False) -> Dict:
+    """Parse, allocate and memoize in one go, as the UI does, for API callers
+
+    ``amounts`` fills products the invoices have no amount for and ``period``
+    (YYYY-MM) is used when the invoices have no billing period. Results of
+    an identical earlier run, from the UI or the API, are reused. A run
+    that would replace stored runs of other invoices is only saved to the
+    history with ``replace_history``; otherwise a warning says so. Raises
+    ValueError if a product amount or the billing period is still missing.
+    """
+    memo_hit = get_result_memo().get(allocation_key(digests, users_hash, vat_mode))
+    if memo_hit is not None:
+        allocation = get_blob_store().get_frame(memo_hit['allocation_hash']) if replace_history else None
+        if allocation is not None:
+            save_allocation(allocation, memo_hit['invoice_meta'], replace=True)
+        return dict(memo_hit, num_auto_added=0, warnings=[], mapping_version=mapping_version())
+
+    parsed = parse_invoices(job, names, digests)
+    invoice_vat = [resolve_include_vat(vat_mode, layout) for layout in parsed['layouts']]
+    product_items = merge_invoice_items([
+        invoice_items(line_items, vat) for line_items, vat in zip(parsed['line_items'], invoice_vat)
+    ])
+    manual_amounts = False
+    for item in product_items:
+        if item['amount'] is None and (amounts or {}).get(item['desc']):
+            item['amount'] = round(float(amounts[item['desc']]), 2)
+            manual_amounts = True
+    # A 0.00 line on the invoice is a real amount; only unread ones are missing
+    missing = [item['desc'] for item in product_items if item['amount'] is None]
+    if missing:
+        raise ValueError(f"Could not extract amounts for: {', '.join(missing)}. Pass them in 'amounts'.")
+
+    invoice_meta = merge_invoice_meta(parsed['metas'])
+    if invoice_meta['period'] is None:
+        if not period:
+            raise ValueError("Could not find the billing period in the invoices. Pass it in 'period' (YYYY-MM).")
+        billing_month = date.fromisoformat(f"{period}-01")
+        invoice_meta['period'] = billing_month.strftime("%Y-%m")
+        invoice_meta['period_start'] = billing_month.isoformat()
+
+    result = allocate_invoice(job, users_hash, product_items, invoice_meta, replace_history)
+    entry = {
+        'allocation_hash': result['allocation_hash'],
+        'summary_hash': result['summary_hash'],
+        'product_items': product_items,
+        'invoice_meta': invoice_meta,
+        'usage_hash': result['usage_hash'],
+        'changes_hash': result['changes_hash'],
+        'include_vat': all(invoice_vat),
+    }
+    # Keyed by the mapping version after any auto-adds; manually entered
+    # amounts aren't part of the key, so those runs aren't shared
+    if not manual_amounts:
+        get_result_memo().put(allocation_key(digests, users_hash, vat_mode), entry)
+    warnings = list(parsed['warnings'])
+    if result['history_overlap']:
+        warnings.append(f"History not saved: {result['history_overlap']}. "
+                        "Submit again with replace_history=true to replace.")
+    return dict(entry, num_auto_added=result['num_auto_added'],
+                warnings=warnings, mapping_version=result['mapping_version'])
+
+
+def excel_bytes(allocation: SparseAllocation) -> bytes:
+    """The allocation as an Excel workbook (runs in a worker process)"""
+    with io.BytesIO() as towrite:
+        allocation.write_excel(towrite)
+        return towrite.getvalue()
+
+
+def build_export(job: Job, allocation_hash: str, export_format: str) -> Optional[str]:
+    """Write the full per-user allocation as CSV or Excel; returns its blob digest"""
+    blob_store = get_blob_store()
+    allocation = blob_store.get_frame(allocation_hash)
+    if allocation is None:
+        return None
+    job.report("Waiting to build the export")
+    with get_admission_queue().slot(job.user, "export", on_wait=job.waiting):
+        if export_format == "CSV":
+            job.report(f"Writing {export_format}", total=len(allocation.users), unit="rows")
+            with io.StringIO() as towrite:
+                allocation.write_csv(towrite, progress=lambda rows: job.report(done=rows))
+                export_bytes = towrite.getvalue().encode("utf-8")
+        else:
+            # openpyxl is pure Python, so the workbook is written in a worker
+            # process (which can't report rows done)
+            job.report(f"Writing {export_format}")
+            export_bytes = run_in_worker(excel_bytes, allocation, on_poll=job.check_cancelled)
+    job.report(f"Storing {export_format}", done=len(export_bytes), unit="bytes")
+    return blob_store.put(export_bytes)
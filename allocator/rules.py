@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Per-product allocation rules; products without a rule are split across all users
+RULES_FILE = os.environ.get("ALLOCATION_RULES_FILE", "allocation_rules.json")
+DEFAULT_RULES = {
+    "Jira Service": {"bu_in": ["IT"]},
+}
+RULE_KEYS = {"bu_in", "bu_not_in", "email_domains", "users", "bu_percentages", "weight_by", "weight_column"}
+# Rule clauses whose outcome depends on a user's Cost To
+BU_RULE_KEYS = {"bu_in", "bu_not_in", "bu_percentages"}
+
+# How eligible users share a product: equally, by seats or a usage column of
+# the users CSV, or by days active within the billing period
+WEIGHT_MODES = {"users", "seats", "usage", "active_days"}
+SEATS_COLUMN = os.environ.get("ALLOCATION_SEATS_COLUMN", "seats")
+ACTIVE_FROM_COLUMN = os.environ.get("ALLOCATION_ACTIVE_FROM_COLUMN", "added_to_org")
+ACTIVE_TO_COLUMN = os.environ.get("ALLOCATION_ACTIVE_TO_COLUMN", "deactivated")
+
+_rules_cache = None
+
+
+class CompiledRule:
+    """One product's rule with its value lists normalised for vectorised matching"""
+
+    __slots__ = ("bu_in", "bu_not_in", "email_domains", "users", "bu_percentages", "weight_by", "weight_column")
+
+    def __init__(self, rule: Dict):
+        unknown = set(rule) - RULE_KEYS
+        if unknown:
+            raise ValueError(f"Unknown allocation rule keys: {', '.join(sorted(unknown))}")
+        self.bu_in = _upper_array(rule.get("bu_in"))
+        self.bu_not_in = _upper_array(rule.get("bu_not_in"))
+        self.email_domains = _lower_array(rule.get("email_domains"))
+        self.users = _lower_array(rule.get("users"))
+        self.bu_percentages = (
+            {str(bu).upper(): float(pct) for bu, pct in rule["bu_percentages"].items()}
+            if rule.get("bu_percentages") else None
+        )
+        self.weight_by = rule.get("weight_by", "users")
+        if self.weight_by not in WEIGHT_MODES:
+            raise ValueError(f"Unknown weight_by '{self.weight_by}', expected one of {', '.join(sorted(WEIGHT_MODES))}")
+        self.weight_column = rule.get("weight_column", SEATS_COLUMN if self.weight_by == "seats" else None)
+        if self.weight_by == "usage" and not self.weight_column:
+            raise ValueError("weight_by 'usage' needs a weight_column")
+
+    @property
+    def depends_on_bu(self) -> bool:
+        return self.bu_in is not None or self.bu_not_in is not None or self.bu_percentages is not None
+
+    def mask(self, cost_to_upper: np.ndarray, emails: np.ndarray, domains: np.ndarray) -> np.ndarray:
+        """Users eligible for this product, as one boolean array"""
+        mask = np.ones(len(emails), dtype=bool)
+        if self.bu_in is not None:
+            mask &= np.isin(cost_to_upper, self.bu_in)
+        if self.bu_not_in is not None:
+            mask &= ~np.isin(cost_to_upper, self.bu_not_in)
+        if self.email_domains is not None:
+            mask &= np.isin(domains, self.email_domains)
+        if self.users is not None:
+            mask &= np.isin(emails, self.users)
+        if self.bu_percentages is not None:
+            mask &= np.isin(cost_to_upper, list(self.bu_percentages))
+        return mask
+
+    def bu_cents(self, total_cents: int, cost_to_upper: np.ndarray, emails: np.ndarray,
+                 domains: np.ndarray, usage: Optional[np.ndarray] = None) -> np.ndarray:
+        """Integer-cent split for a per-BU percentage rule
+
+        The amount is first apportioned to BUs by percentage, then inside
+        each BU by the users' weights, so every BU total matches its
+        percentage to the cent. Ties for a leftover cent go to the earlier row.
+        """
+        weights = self.weights(cost_to_upper, emails, domains, usage)
+        mask = weights > 0
+        cents = np.zeros(len(emails), dtype=np.int64)
+        if not mask.any():
+            return cents
+        codes, bus = pd.factorize(cost_to_upper[mask])
+        bu_weight = np.bincount(codes, weights=weights[mask], minlength=len(bus))
+        bu_total = _largest_remainder(bu_weight * total_cents, total_cents)
+
+        exact = bu_total[codes] * weights[mask] / bu_weight[codes]
+        floors = np.floor(exact + 1e-9).astype(np.int64)
+        leftover = bu_total - np.bincount(codes, weights=floors, minlength=len(bus)).astype(np.int64)
+        # Rank users within their BU by remainder, largest first
+        order = np.lexsort((-(exact - floors), codes))
+        starts = np.searchsorted(codes[order], np.arange(len(bus)))
+        ranks = np.empty(len(order), dtype=np.int64)
+        ranks[order] = np.arange(len(order)) - starts[codes[order]]
+        cents[mask] = floors + (ranks < leftover[codes])
+        return cents
+
+    def weights(self, cost_to_upper: np.ndarray, emails: np.ndarray, domains: np.ndarray,
+                usage: Optional[np.ndarray] = None) -> np.ndarray:
+        """Each user's fraction of the product amount (sums to 1, or 0 if nobody is eligible)
+
+        ``usage`` holds each user's seats, usage or active days for weighted
+        rules; eligible users with no usage at all fall back to an even split.
+        """
+        mask = self.mask(cost_to_upper, emails, domains)
+        if not mask.any():
+            return np.zeros(len(emails))
+        raw = mask.astype(float)
+        if usage is not None and (usage[mask] > 0).any():
+            raw = np.where(mask, np.clip(usage, 0, None), 0.0)
+        if self.bu_percentages is None:
+            return raw / raw.sum()
+
+        # Fixed per-BU percentages, split by weight within each BU; BUs
+        # without eligible users drop out and the rest are rescaled to 100%
+        codes, bus = pd.factorize(cost_to_upper)
+        bu_raw = np.bincount(codes, weights=raw, minlength=len(bus))
+        pct = np.array([self.bu_percentages.get(bu, 0.0) for bu in bus])
+        pct[bu_raw == 0] = 0.0
+        if pct.sum() == 0:
+            return np.zeros(len(emails))
+        per_raw = np.divide(pct / pct.sum(), bu_raw, out=np.zeros(len(bus)), where=bu_raw > 0)
+        return raw * per_raw[codes]
+
+
+def _largest_remainder(exact: np.ndarray, total: int) -> np.ndarray:
+    """Round shares down to integers, then hand the leftover to the largest remainders"""
+    floors = np.floor(exact + 1e-9).astype(np.int64)
+    leftover = total - floors.sum()
+    if leftover > 0:
+        floors[np.argsort(-(exact - floors), kind="stable")[:leftover]] += 1
+    return floors
+
+
+def _upper_array(values) -> Optional[np.ndarray]:
+    return None if values is None else np.array([str(v).strip().upper() for v in values])
+
+
+def _lower_array(values) -> Optional[np.ndarray]:
+    return None if values is None else np.array([str(v).strip().lower().lstrip("@") for v in values])
+
+
+def load_rules() -> Dict[str, CompiledRule]:
+    """Rules from RULES_FILE (or DEFAULT_RULES), compiled once per file version"""
+    global _rules_cache
+    version = rules_version()
+    if _rules_cache is None or _rules_cache[0] != version:
+        raw = DEFAULT_RULES
+        if os.path.exists(RULES_FILE):
+            with open(RULES_FILE) as f:
+                raw = json.load(f)
+        _rules_cache = (version, {product: CompiledRule(rule) for product, rule in raw.items()})
+    return _rules_cache[1]
+
+
+def rules_version() -> str:
+    """Content hash of the rules, used to key cached results"""
+    if not os.path.exists(RULES_FILE):
+        return hashlib.sha256(json.dumps(DEFAULT_RULES, sort_keys=True).encode()).hexdigest()[:16]
+    with open(RULES_FILE, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def user_arrays(cost_to: pd.Series, emails: pd.Series):
+    """Upper-cased BUs, lower-cased emails and email domains as numpy arrays"""
+    emails = emails.fillna("").astype(str).str.lower()
+    return (
+        cost_to.fillna("").astype(str).str.upper().to_numpy(),
+        emails.to_numpy(),
+        emails.str.rpartition("@")[2].to_numpy(),
+    )
+
+
+def usage_matrix(product_names: List[str], users: pd.DataFrame, period_start: Optional[str] = None,
+                 period_end: Optional[str] = None,
+                 rules: Optional[Dict[str, CompiledRule]] = None) -> Optional[pd.DataFrame]:
+    """Per-user seats, usage or active days for the products with a weighted rule
+
+    One column per weighted product, rows aligned with ``users``; None when
+    every product is split evenly. Raises ValueError if a usage column named
+    by a rule is missing from the users CSV.
+    """
+    rules = load_rules() if rules is None else rules
+    weighted = [name for name in product_names if name in rules and rules[name].weight_by != "users"]
+    if not weighted:
+        return None
+
+    usage = pd.DataFrame(index=pd.RangeIndex(len(users)))
+    for name in weighted:
+        rule = rules[name]
+        if rule.weight_by == "active_days":
+            usage[name] = _active_days(users, period_start, period_end)
+        elif rule.weight_column in users.columns:
+            usage[name] = _numeric(users[rule.weight_column])
+        elif rule.weight_by == "seats":
+            usage[name] = 1.0  # one seat each unless the CSV says otherwise
+        else:
+            raise ValueError(f"Users CSV has no '{rule.weight_column}' column for {name}")
+    return usage
+
+
+def _numeric(values: pd.Series) -> np.ndarray:
+    """Counts as numbers and access flags (True/yes/x) as 1, anything else 0"""
+    if values.dtype == bool:
+        return values.to_numpy(dtype=float)
+    numbers = pd.to_numeric(values, errors="coerce")
+    flags = values.astype(str).str.strip().str.lower().isin(["true", "yes", "y", "x"])
+    return numbers.fillna(flags.astype(float)).to_numpy(dtype=float)
+
+
+def _active_days(users: pd.DataFrame, period_start: Optional[str], period_end: Optional[str]) -> np.ndarray:
+    """Days each user was active within the billing period (whole period if unknown)"""
+    if period_start is None:
+        return np.ones(len(users))
+    start = np.datetime64(period_start, "D")
+    # Billing periods without an end date run to the end of the start month
+    end = (np.datetime64(period_end, "D") if period_end
+           else (np.datetime64(period_start[:7], "M") + 1).astype("datetime64[D]") - 1)
+
+    def dates(column, default):
+        if column not in users.columns:
+            return np.full(len(users), default)
+        parsed = pd.to_datetime(users[column], errors="coerce", utc=True, format="mixed").dt.tz_localize(None)
+        return parsed.to_numpy(dtype="datetime64[D]", na_value=default)
+
+    active_from = np.maximum(dates(ACTIVE_FROM_COLUMN, start), start)
+    active_to = np.minimum(dates(ACTIVE_TO_COLUMN, end), end)
+    return np.clip((active_to - active_from).astype(np.int64) + 1, 0, None).astype(float)
+
+
+def usage_column(usage: Optional[pd.DataFrame], name: str) -> Optional[np.ndarray]:
+    if usage is None or name not in usage.columns:
+        return None
+    return usage[name].to_numpy(dtype=float)
@@ -0,0 +1,303 @@
+"""HTTP API for the allocation engine, for tools that can't drive the Streamlit UI
+
+Runs as its own process alongside the UI, on the same host and working
+directory, and shares its blob store, BU mapping file, allocation history
+and admission slots through the filesystem (with file locks); the result
+memo is shared when ALLOCATION_MEMO_PERSIST=1:
+
+    uvicorn api:app --port 8000
+
+Uploads are read asynchronously and processed as background jobs on a
+thread pool, queued for the admission slots like the UI's. The CPU-bound
+stages (text extraction of several invoices at once, the allocation split
+and Excel exports) run on worker processes, one per admission slot.
+
+    POST   /allocations               multipart: invoice (one or more), users,
+                                      vat_mode, period (YYYY-MM), amounts (JSON),
+                                      replace_history (true to replace stored
+                                      runs of other invoices)
+    GET    /jobs/{job_id}             status and progress
+    DELETE /jobs/{job_id}             cancel
+    GET    /jobs/{job_id}/summary     cost per BU as JSON
+    GET    /jobs/{job_id}/export      per-user allocation, ?format=csv|xlsx
+    GET    /mapping                   all BU mappings
+    GET    /mapping/{email}
+    PUT    /mapping/{email}           JSON: user_name, cost_to
+    DELETE /mapping/{email}
+"""
+import json
+import os
+import re
+
+import pandas as pd
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from allocator.blobstore import get_blob_store
+from allocator.invoice import PdfBudgetError, PdfValidationError
+from allocator.jobs import get_job_manager
+from allocator.layout import VAT_MODES
+from allocator.mapping import COLUMNS, load_bu_mapping, mapping_lock, mapping_version, save_bu_mapping
+from allocator.pipeline import build_export, run_allocation
+
+API_HOST = os.environ.get("API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("API_PORT", 8000))
+# Header naming the calling tool or user, so the admission queue can share
+# slots fairly between callers; the client address is used without it
+API_USER_HEADER = os.environ.get("API_USER_HEADER", "X-User")
+# Bytes per chunk when streaming a stored export
+API_STREAM_CHUNK_BYTES = 1024 * 1024
+
+EXPORT_FORMATS = {
+    "csv": ("CSV", "text/csv", "expense_allocation.csv"),
+    "xlsx": ("Excel", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+             "expense_allocation.xlsx"),
+}
+# API field names for the BU mapping columns
+MAPPING_FIELDS = {"user_name": "User name", "email": "Email", "cost_to": "Cost To"}
+
+
+def error(status_code: int, message: str) -> JSONResponse:
+    return JSONResponse({"error": message}, status_code=status_code)
+
+
+def caller(request: Request) -> str:
+    return request.headers.get(API_USER_HEADER) or (request.client.host if request.client else "api")
+
+
+def job_status(job) -> dict:
+    status = {
+        "id": job.id,
+        "status": job.status,
+        "stage": job.stage,
+        "message": job.describe(),
+        "done": job.done,
+        "total": job.total,
+        "unit": job.unit,
+        "fraction": job.fraction,
+        "queue_position": job.queue_position,
+        "error": str(job.error) if job.error is not None else None,
+    }
+    if job.status == "done":
+        status["summary_url"] = f"/jobs/{job.id}/summary"
+        status["export_url"] = f"/jobs/{job.id}/export"
+    return status
+
+
+def finished_job(job_id: str):
+    """The finished allocation job, or the error response explaining why not"""
+    job = get_job_manager().get(job_id)
+    if job is None or job.kind != "allocate":
+        return None, error(404, "Unknown or expired job")
+    if job.status != "done":
+        return None, JSONResponse(job_status(job), status_code=409)
+    return job, None
+
+
+async def create_allocation(request: Request) -> Response:
+    form = await request.form()
+    invoices = [f for f in form.getlist("invoice") if hasattr(f, "read")]
+    users = form.get("users")
+    if not invoices or not hasattr(users, "read"):
+        return error(400, "Upload one or more 'invoice' files and a 'users' CSV")
+    vat_mode = form.get("vat_mode") or "auto"
+    if vat_mode not in VAT_MODES:
+        return error(400, f"vat_mode must be one of: {', '.join(VAT_MODES)}")
+    period = form.get("period") or None
+    if period is not None and not re.fullmatch(r"\d{4}-(0[1-9]|1[0-2])", period):
+        return error(400, "period must look like YYYY-MM")
+    replace_history = str(form.get("replace_history") or "").lower() in ("1", "true", "yes")
+    try:
+        amounts = json.loads(form.get("amounts") or "{}")
+        amounts = {str(desc): float(amount) for desc, amount in amounts.items()}
+    except (ValueError, TypeError, AttributeError):
+        return error(400, "amounts must be a JSON object of product name -> amount")
+
+    # Same content-addressed storage as the UI, so identical files are stored once
+    blob_store = get_blob_store()
+    names = [f.filename or "invoice" for f in invoices]
+    digests = [await run_in_threadpool(blob_store.put, await f.read()) for f in invoices]
+    users_hash = await run_in_threadpool(blob_store.put, await users.read())
+    await form.close()
+
+    job = get_job_manager().submit(
+        "allocate", caller(request), (tuple(digests), users_hash, vat_mode, replace_history),
+        run_allocation, names, digests, users_hash, vat_mode, amounts, period, replace_history,
+    )
+    return JSONResponse({"job_id": job.id, "status_url": f"/jobs/{job.id}"}, status_code=202)
+
+
+async def get_job(request: Request) -> Response:
+    job = get_job_manager().get(request.path_params["job_id"])
+    if job is None:
+        return error(404, "Unknown or expired job")
+    status = job_status(job)
+    if isinstance(job.error, (PdfValidationError, PdfBudgetError)):
+        status["error_type"] = "invalid_invoice"
+    return JSONResponse(status)
+
+
+async def cancel_job(request: Request) -> Response:
+    job = get_job_manager().get(request.path_params["job_id"])
+    if job is None:
+        return error(404, "Unknown or expired job")
+    get_job_manager().cancel(job.id)
+    return JSONResponse(job_status(job), status_code=202)
+
+
+async def get_summary(request: Request) -> Response:
+    job, failure = finished_job(request.path_params["job_id"])
+    if failure is not None:
+        return failure
+    result = job.result
+    summary = await run_in_threadpool(get_blob_store().get_frame, result["summary_hash"])
+    if summary is None:
+        return error(410, "Results have expired from the server cache; submit the files again")
+    return JSONResponse({
+        "invoice_meta": result["invoice_meta"],
+        "include_vat": result["include_vat"],
+        "product_items": result["product_items"],
+        "num_auto_added": result["num_auto_added"],
+        "warnings": result["warnings"],
+        "mapping_version": result["mapping_version"],
+        "summary": json.loads(summary.to_json(orient="records")),
+    })
+
+
+def iter_csv(allocation):
+    """CSV text of the allocation, one block of users at a time"""
+    for i, frame in enumerate(allocation.iter_frames()):
+        yield frame.to_csv(index=False, header=i == 0)
+
+
+def iter_blob(data: bytes):
+    for start in range(0, len(data), API_STREAM_CHUNK_BYTES):
+        yield data[start:start + API_STREAM_CHUNK_BYTES]
+
+
+async def get_export(request: Request) -> Response:
+    job, failure = finished_job(request.path_params["job_id"])
+    if failure is not None:
+        return failure
+    export_format = request.query_params.get("format", "csv").lower()
+    if export_format not in EXPORT_FORMATS:
+        return error(400, f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    label, media_type, filename = EXPORT_FORMATS[export_format]
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    blob_store = get_blob_store()
+
+    # CSV is written while it is sent; the sync generator runs in the thread pool
+    if export_format == "csv":
+        allocation = await run_in_threadpool(blob_store.get_frame, job.result["allocation_hash"])
+        if allocation is None:
+            return error(410, "Results have expired from the server cache; submit the files again")
+        return StreamingResponse(iter_csv(allocation), media_type=media_type, headers=headers)
+
+    # A workbook can't be streamed while written, so build it as an export job
+    export_job = get_job_manager().submit(
+        "export", job.user, (job.result["allocation_hash"], label),
+        build_export, job.result["allocation_hash"], label,
+    )
+    await run_in_threadpool(export_job.wait)
+    if export_job.error is not None:
+        return error(500, str(export_job.error))
+    data = await run_in_threadpool(blob_store.get, export_job.result)
+    if data is None:
+        return error(410, "Results have expired from the server cache; submit the files again")
+    return StreamingResponse(iter_blob(data), media_type=media_type, headers=headers)
+
+
+def mapping_rows(bu_df: pd.DataFrame) -> list:
+    bu_df = bu_df.rename(columns={column: field for field, column in MAPPING_FIELDS.items()})
+    return json.loads(bu_df.fillna("").astype(str).to_json(orient="records"))
+
+
+def email_rows(bu_df: pd.DataFrame, email: str) -> pd.Series:
+    return bu_df['Email'].astype(str).str.lower() == email.lower()
+
+
+async def list_mapping(request: Request) -> Response:
+    bu_df = await run_in_threadpool(load_bu_mapping)
+    return JSONResponse({"mapping_version": mapping_version(), "rows": mapping_rows(bu_df)})
+
+
+async def get_mapping(request: Request) -> Response:
+    bu_df = await run_in_threadpool(load_bu_mapping)
+    rows = mapping_rows(bu_df[email_rows(bu_df, request.path_params["email"])])
+    if not rows:
+        return error(404, "Email not in the BU mapping")
+    return JSONResponse(rows[-1])
+
+
+def _put_mapping(email: str, user_name: str, cost_to: str) -> bool:
+    """Add or replace the row for an email; True if it was added"""
+    # Stored lower-cased, as allocations look emails up
+    email = email.strip().lower()
+    with mapping_lock():
+        bu_df = load_bu_mapping()
+        matches = email_rows(bu_df, email)
+        if not user_name and matches.any():
+            user_name = bu_df.loc[matches, 'User name'].iloc[-1]
+        row = pd.DataFrame([{"User name": user_name, "Email": email, "Cost To": cost_to}], columns=COLUMNS)
+        save_bu_mapping(pd.concat([bu_df[~matches], row], ignore_index=True))
+        return not matches.any()
+
+
+def _delete_mapping(email: str) -> bool:
+    """Remove all rows for an email; False if it had none"""
+    with mapping_lock():
+        bu_df = load_bu_mapping()
+        matches = email_rows(bu_df, email)
+        if not matches.any():
+            return False
+        save_bu_mapping(bu_df[~matches].reset_index(drop=True))
+        return True
+
+
+async def put_mapping(request: Request) -> Response:
+    email = request.path_params["email"]
+    try:
+        body = await request.json()
+    except ValueError:
+        return error(400, "Body must be JSON with cost_to and optionally user_name")
+    if not isinstance(body, dict) or not str(body.get("cost_to") or "").strip():
+        return error(400, "Body must be JSON with cost_to and optionally user_name")
+    added = await run_in_threadpool(
+        _put_mapping, email, str(body.get("user_name") or "").strip(), str(body["cost_to"]).strip(),
+    )
+    bu_df = await run_in_threadpool(load_bu_mapping)
+    rows = mapping_rows(bu_df[email_rows(bu_df, email)])
+    return JSONResponse(rows[-1], status_code=201 if added else 200)
+
+
+async def delete_mapping(request: Request) -> Response:
+    if not await run_in_threadpool(_delete_mapping, request.path_params["email"]):
+        return error(404, "Email not in the BU mapping")
+    return Response(status_code=204)
+
+
+async def health(request: Request) -> Response:
+    return JSONResponse({"status": "ok"})
+
+
+app = Starlette(routes=[
+    Route("/health", health),
+    Route("/allocations", create_allocation, methods=["POST"]),
+    Route("/jobs/{job_id}", get_job, methods=["GET"]),
+    Route("/jobs/{job_id}", cancel_job, methods=["DELETE"]),
+    Route("/jobs/{job_id}/summary", get_summary),
+    Route("/jobs/{job_id}/export", get_export),
+    Route("/mapping", list_mapping),
+    Route("/mapping/{email}", get_mapping, methods=["GET"]),
+    Route("/mapping/{email}", put_mapping, methods=["PUT"]),
+    Route("/mapping/{email}", delete_mapping, methods=["DELETE"]),
+])
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=API_HOST, port=API_PORT)
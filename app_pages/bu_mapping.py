@@ -0,0 +1,278 @@
+import io
+import os
+import time
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+
+from allocator.mapping import (
+    COLUMNS,
+    PERSIST_FILE,
+    MappingChangedError,
+    load_bu_mapping,
+    mapping_stamp,
+    replace_bu_mapping,
+)
+
+st.title("👥 Business Unit Mapping Management")
+st.markdown("**Manage user-to-business unit mappings for cost allocation**")
+
+with st.expander("📋 How to Manage Mappings", expanded=False):
+    st.markdown("""
+    **Primary Methods (Recommended):**
+    • **➕ Add Users:** Click the **+** button at the bottom of the table to add new rows
+    • **✏️ Edit Data:** Click on any cell in the table to edit user information directly
+    • **🗑️ Delete Users:** Use checkboxes to select rows, then they'll be removed
+    • **💾 Save Changes:** Click 'Save Changes' to persist all your modifications
+
+    **Alternative Method:**
+    • **📁 Bulk Upload:** Upload Excel file only when you need to replace ALL data at once
+    • **📥 Export:** Download current mapping as Excel for backup or sharing
+    """)
+
+@st.cache_data(show_spinner=False)
+def cached_bu_mapping(stamp):
+    """Load the mapping once per saved file"""
+    return load_bu_mapping()
+
+
+# Load existing or create new; saves are refused if the file changed since
+loaded_stamp = mapping_stamp()
+bu_df = cached_bu_mapping(loaded_stamp)
+
+# Show current data statistics
+if not bu_df.empty:
+    total_users = len(bu_df)
+    unique_bus = bu_df['Cost To'].nunique()
+    st.info(f"📊 **Current Data:** {total_users} users mapped to {unique_bus} business units")
+else:
+    st.info("📊 **Database is empty** - Add your first user mapping below")
+
+st.divider()
+
+# Get options for Cost To dropdown
+existing_cost_to = bu_df['Cost To'].dropna().unique().tolist() if not bu_df.empty else []
+default_options = ["IT", "Finance", "Marketing", "Sales", "HR", "Operations", "Club", "FS", "Unknown"]
+all_options = list(set(default_options + existing_cost_to))
+all_options.sort()
+
+st.markdown("### � User Mapping Database")
+
+# Quick stats and tips
+col_info1, col_info2 = st.columns(2)
+with col_info1:
+    if not bu_df.empty:
+        st.metric("👥 Total Users", len(bu_df))
+with col_info2:
+    if not bu_df.empty:
+        unique_cost_centers = bu_df['Cost To'].nunique()
+        st.metric("🏢 Business Units", unique_cost_centers)
+
+st.markdown("**� How to manage rows:**")
+col_tip1, col_tip2, col_tip3 = st.columns(3)
+with col_tip1:
+    st.markdown("📝 **Add:** Click **+** at bottom of table")
+with col_tip2:
+    st.markdown("✏️ **Edit:** Click any cell to modify")
+with col_tip3:
+    st.markdown("🗑️ **Delete:** Select row checkbox, then delete icon")
+
+# Show instruction before table
+st.info("📝 **Instructions:** Use checkboxes on the left to select rows for deletion. Click the trash icon to delete selected rows.")
+
+
+def reload_editor():
+    """Rerun the whole page with a fresh editor (and bulk uploader) over the saved mapping
+
+    A fragment rerun keeps the mapping from the last full run, and the
+    editor keeps its edits on top of whatever it is given, so both are
+    replaced.
+    """
+    st.session_state.bu_editor_generation = st.session_state.get("bu_editor_generation", 0) + 1
+    st.rerun(scope="app")
+
+
+@st.fragment
+def save_controls():
+    """Save/reset/export buttons and Auto-save; toggling them reruns only this block"""
+    edited_df = st.session_state.bu_edited_df
+    data_changed = st.session_state.bu_data_changed
+
+    # Save options - prominent and clear
+    col1, col2, col3, col4 = st.columns([1, 1, 1, 1])
+    with col1:
+        if st.button("💾 **Save Changes**", use_container_width=True, type="primary", disabled=not data_changed):
+            try:
+                # Save to Excel directly in current directory
+                replace_bu_mapping(edited_df, st.session_state.bu_loaded_stamp)
+                st.success(f"✅ **Saved successfully!** {len(edited_df)} records saved to {PERSIST_FILE}")
+
+                # Update session state to reflect saved data
+                st.session_state.bu_data_saved = True
+
+                # Refresh the page to show updated data
+                reload_editor()
+
+            except MappingChangedError as e:
+                st.error(f"❌ **Not saved:** {e}")
+            except Exception as e:
+                st.error(f"❌ **Save failed:** {str(e)}")
+
+    with col2:
+        if st.button("🔄 **Reset to Last Saved**", use_container_width=True, disabled=not data_changed):
+            reload_editor()
+
+    with col3:
+        if st.button("📥 **Export Excel**", use_container_width=True):
+            try:
+                # Create a temporary file for download
+                buffer = io.BytesIO()
+                edited_df.to_excel(buffer, index=False, engine='openpyxl')
+                buffer.seek(0)
+
+                st.download_button(
+                    label="📥 Download Excel File",
+                    data=buffer.getvalue(),
+                    file_name=f"bu_mapping_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    use_container_width=True
+                )
+            except Exception as e:
+                st.error(f"❌ Export failed: {str(e)}")
+
+    with col4:
+        # Auto-save toggle
+        auto_save = st.checkbox("🔄 Auto-save", value=False, help="Automatically save changes every few seconds")
+
+    # Auto-save functionality
+    if auto_save and data_changed:
+        if "last_auto_save" not in st.session_state:
+            st.session_state.last_auto_save = time.time()
+
+        # Auto-save every 5 seconds if changes detected
+        if time.time() - st.session_state.last_auto_save > 5:
+            try:
+                replace_bu_mapping(edited_df, st.session_state.bu_loaded_stamp)
+                st.session_state.last_auto_save = time.time()
+                st.success("🔄 **Auto-saved!**", icon="✅")
+                # The saved data is the editor's new baseline
+                reload_editor()
+            except MappingChangedError as e:
+                st.error(f"❌ Auto-save stopped: {e}")
+            except Exception as e:
+                st.error(f"❌ Auto-save failed: {str(e)}")
+
+    # Show current save status
+    if os.path.exists(PERSIST_FILE):
+        file_time = datetime.fromtimestamp(os.path.getmtime(PERSIST_FILE))
+        st.caption(f"📁 **Last saved:** {file_time.strftime('%Y-%m-%d %H:%M:%S')} | **Rows:** {len(edited_df)} | **File:** {PERSIST_FILE}")
+    else:
+        st.caption("📁 **No saved file found** - Save your changes to create the database file")
+
+
+@st.fragment
+def mapping_editor(bu_df, all_options, loaded_stamp):
+    """Data editor region; a cell edit reruns only the editor and its save controls"""
+    # Dynamic data editor with improved visibility
+    edited_df = st.data_editor(
+        bu_df,
+        num_rows="dynamic",
+        use_container_width=True,
+        key=f"bu_editor_{st.session_state.get('bu_editor_generation', 0)}",
+        height=400,  # Set fixed height to show more rows
+        hide_index=False,  # Keep index visible for debugging
+        column_config={
+            "User name": st.column_config.TextColumn(
+                "👤 User Name",
+                help="Full name of the user",
+                required=True,
+                width="medium"
+            ),
+            "Email": st.column_config.TextColumn(
+                "📧 Email",
+                help="User email address - must be unique",
+                required=True,
+                width="large"
+            ),
+            "Cost To": st.column_config.SelectboxColumn(
+                "🏢 Cost To (BU)",
+                help="Business unit for cost allocation",
+                options=all_options,
+                required=True,
+                width="small"
+            )
+        },
+        disabled=False  # Ensure editing is enabled
+    )
+
+    # Check if data has changed and show save options
+    data_changed = not edited_df.equals(bu_df)
+    st.session_state.bu_edited_df = edited_df
+    st.session_state.bu_data_changed = data_changed
+    st.session_state.bu_loaded_stamp = loaded_stamp
+
+    if data_changed:
+        st.warning("⚠️ **คุณมีการเปลี่ยนแปลงข้อมูลที่ยังไม่ได้บันทึก!** กรุณากดปุ่ม Save เพื่อบันทึกการเปลี่ยนแปลง")
+
+    save_controls()
+
+
+mapping_editor(bu_df, all_options, loaded_stamp)
+
+st.divider()
+
+# Additional tips
+with st.expander("🎁 Quick Tips for Table Management", expanded=False):
+    st.markdown("""
+    **✅ To Add New Users:**
+    1. Scroll to bottom of table
+    2. Click the **+** (plus) button 
+    3. Fill in the new row with user details
+    4. **Click Save Changes** to persist data
+
+    **✂️ To Delete Users:**
+    1. Find the checkbox column on the **left side** of the table
+    2. Click checkboxes to select rows you want to delete
+    3. Look for the **trash/delete icon** (usually appears after selection)
+    4. Click the delete icon to remove selected rows
+    5. **Click Save Changes** to make deletion permanent
+
+    **✏️ To Edit Users:**
+    - Simply click on any cell and type new information
+    - Use dropdown for Cost To (BU) column
+    - **Click Save Changes** after editing
+
+    **💾 Important:**
+    - **ALWAYS click "Save Changes"** after any modifications
+    - Changes are temporary until you save!
+    - Use Auto-save for convenience (saves every 5 seconds)
+    """)
+
+# Advanced options section
+with st.expander("⚙️ Advanced Options & Bulk Operations", expanded=False):
+    st.markdown("**⚠️ Bulk Data Replacement**")
+    st.markdown("*Use this only when you need to replace ALL existing data*")
+
+    bu_upload = st.file_uploader(
+        "Upload Excel file to replace ALL current mappings", 
+        type=["xlsx"],
+        help="⚠️ This will completely replace your current database!",
+        key=f"bu_upload_{st.session_state.get('bu_editor_generation', 0)}",
+    )
+    if bu_upload:
+        try:
+            upload_df = pd.read_excel(bu_upload)
+            for col in COLUMNS:
+                if col not in upload_df.columns:
+                    upload_df[col] = ""
+            bu_df = upload_df[COLUMNS]
+            replace_bu_mapping(bu_df, loaded_stamp)
+            st.success("✅ All BU Mappings replaced with uploaded data!")
+            # Also clears the uploader, which would otherwise replace the mapping on every rerun
+            reload_editor()
+        except MappingChangedError as e:
+            st.error(f"❌ **Not replaced:** {e}")
+        except Exception as e:
+            st.error(f"❌ Upload failed: {str(e)}")
+
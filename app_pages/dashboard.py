@@ -0,0 +1,56 @@
+import os
+
+import streamlit as st
+
+from allocator.history import CUBE_FILE, list_periods, load_cube, rebuild_cube
+
+
+@st.cache_data(show_spinner=False)
+def cached_cube(mtime):
+    """Load the summary cube once per saved allocation (keyed by mtime)"""
+    return load_cube()
+
+
+st.title("📈 Cost Dashboard")
+st.markdown("**BU and product cost trends across billing periods**")
+
+cube = cached_cube(os.path.getmtime(CUBE_FILE) if os.path.exists(CUBE_FILE) else None)
+if cube.empty:
+    if list_periods():
+        st.info("📦 Allocation history exists but has not been summarised yet.")
+        if st.button("🔄 Build dashboard data from history", type="primary"):
+            rebuild_cube()
+            st.rerun()
+    else:
+        st.info("📭 No allocations saved yet - run an allocation on the Expense Allocation page first.")
+    st.stop()
+
+periods = sorted(cube['period'].unique())
+all_bus = sorted(cube['cost_to'].unique())
+selected_bus = st.multiselect("🏢 Business units", all_bus, default=all_bus)
+cube = cube[cube['cost_to'].isin(selected_bus)]
+
+# Latest period at a glance
+latest = cube[cube['period'] == periods[-1]]
+previous = cube[cube['period'] == periods[-2]] if len(periods) > 1 else None
+col1, col2, col3 = st.columns(3)
+with col1:
+    latest_total = latest['amount'].sum()
+    delta = None if previous is None else f"{latest_total - previous['amount'].sum():,.2f}"
+    st.metric(f"💰 Total {periods[-1]}", f"{latest_total:,.2f}", delta=delta, delta_color="inverse")
+with col2:
+    st.metric("🏢 Business Units", latest['cost_to'].nunique())
+with col3:
+    st.metric("🗓️ Periods", len(periods))
+
+st.markdown("### 🏢 Cost per Business Unit")
+by_bu = cube.pivot_table(index='period', columns='cost_to', values='amount', aggfunc='sum', fill_value=0)
+st.line_chart(by_bu)
+
+st.markdown("### 📦 Cost per Product")
+by_product = cube.pivot_table(index='period', columns='product', values='amount', aggfunc='sum', fill_value=0)
+st.bar_chart(by_product)
+
+with st.expander("👥 Charged users per BU and product", expanded=False):
+    users = cube.pivot_table(index=['period', 'cost_to'], columns='product', values='users', aggfunc='sum', fill_value=0)
+    st.dataframe(users, use_container_width=True)
@@ -0,0 +1,582 @@
+import io
+from contextlib import contextmanager
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from allocator.admission import get_admission_queue
+from allocator.blobstore import get_blob_store
+from allocator.engine import reallocate
+from allocator.history import HistoryOverlapError, save_allocation
+from allocator.invoice import (
+    PdfBudgetError,
+    PdfValidationError,
+    invoice_items,
+    merge_invoice_items,
+    merge_invoice_meta,
+)
+from allocator.jobs import JOB_INLINE_WAIT_SECONDS, get_job_manager
+from allocator.layout import VAT_MODES, resolve_include_vat
+from allocator.mapping import DEFAULT_COST_TO, load_bu_lookup, mapping_version
+from allocator.memo import allocation_key, get_result_memo
+from allocator.pipeline import allocate_invoice, build_export, parse_invoices
+from allocator.period import save_period
+
+blob_store = get_blob_store()
+admission = get_admission_queue()
+jobs = get_job_manager()
+
+# Full allocation export formats: file name and MIME type
+EXPORT_FORMATS = {
+    "Excel": ("Expense_Allocation_Output.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "CSV": ("Expense_Allocation_Output.csv", "text/csv"),
+}
+
+# Initialize session state - uploads and results live in the blob store,
+# the session only keeps their content hashes
+if 'uploaded_files' not in st.session_state:
+    st.session_state.uploaded_files = {
+        'pdf_files': None,  # One or more invoices, allocated together
+        'csv_file': None,
+        'pdf_hashes': None,
+        'users_hash': None,
+        'vat_mode': 'auto',    # VAT handling picked on the form (auto-detect by default)
+        'include_vat': False,  # Whether the results include VAT
+        'allocation_hash': None,  # Cache for allocation results
+        'summary_hash': None,     # Cache for summary results
+        'product_items': None,    # Invoice amounts the results were split from
+        'mapping_version': None,  # BU mapping version the results were computed with
+        'manual_amounts': False,  # Results used manually entered amounts
+        'changes_hash': None,     # Joiners/leavers/BU moves since the previous period
+        'invoice_meta': None,     # Invoice number and billing period
+        'usage_hash': None,       # Seats/usage/active days of weighted products
+        'line_items': None,       # Parsed invoice lines per PDF, both VAT modes
+        'invoice_metas': None,    # Invoice number and billing period per PDF
+        'invoice_layouts': None,  # Detected column layout per PDF
+        'results_vat_mode': None, # VAT mode the results were computed with
+        'invoice_warnings': None, # Pre-check/OCR warnings from parsing the invoices
+        'history_overlap': None,  # Why the results weren't saved to the history
+        'job_id': None,           # Background job working on these inputs
+    }
+# Bumped to give the file uploaders a new key, which clears them
+if 'uploader_generation' not in st.session_state:
+    st.session_state.uploader_generation = 0
+
+
+def store_upload(uploaded_file, name_key, hash_key):
+    """Spill an upload to the blob store; new content invalidates cached results"""
+    digest = blob_store.put(uploaded_file.getvalue())
+    if st.session_state.uploaded_files[hash_key] != digest:
+        jobs.cancel(st.session_state.uploaded_files['job_id'])
+        st.session_state.uploaded_files['allocation_hash'] = None
+        st.session_state.uploaded_files['summary_hash'] = None
+        st.session_state.uploaded_files['changes_hash'] = None
+    st.session_state.uploaded_files[name_key] = uploaded_file.name
+    st.session_state.uploaded_files[hash_key] = digest
+
+
+def store_pdf_uploads(uploaded_files):
+    """Spill all invoice uploads to the blob store; a different set invalidates cached results"""
+    digests = [blob_store.put(f.getvalue()) for f in uploaded_files]
+    if st.session_state.uploaded_files['pdf_hashes'] != digests:
+        jobs.cancel(st.session_state.uploaded_files['job_id'])
+        st.session_state.uploaded_files['allocation_hash'] = None
+        st.session_state.uploaded_files['summary_hash'] = None
+        st.session_state.uploaded_files['changes_hash'] = None
+        st.session_state.uploaded_files['line_items'] = None
+    st.session_state.uploaded_files['pdf_files'] = [f.name for f in uploaded_files]
+    st.session_state.uploaded_files['pdf_hashes'] = digests
+
+
+def session_user() -> str:
+    """Who the work queue treats as one user: the signed-in account, else this browser session"""
+    # st.user only exists from Streamlit 1.42
+    user = getattr(st, "user", None)
+    if getattr(user, "is_logged_in", False) and user.get("email"):
+        return user.email
+    return get_script_run_ctx().session_id
+
+
+@contextmanager
+def heavy_stage(stage, weight=1):
+    """Run a CPU-heavy stage in a shared worker slot, showing the queue position while waiting"""
+    placeholder = st.empty()
+
+    def on_wait(position):
+        placeholder.info(f"⏳ Server busy - {stage} is number {position} in the queue...")
+
+    try:
+        with admission.slot(session_user(), stage, weight, on_wait):
+            placeholder.empty()
+            yield
+    finally:
+        placeholder.empty()
+
+
+@st.fragment(run_every=1.0)
+def show_job_progress(job_id):
+    """Live progress of a background job; reruns the page once it has finished"""
+    job = jobs.get(job_id)
+    if job is None or job.finished:
+        st.rerun()
+    st.progress(job.fraction, text=f"⏳ {job.describe()}")
+    if st.button("⏹️ Cancel", key=f"cancel_{job_id}"):
+        job.cancel()
+
+
+def run_job(session, kind, inputs, fn, *args):
+    """The session's finished background job for these inputs
+
+    Starts the job if there is none (cancelling one for older inputs), and
+    while it runs shows its progress and stops the script; the result is
+    picked up on the rerun after it finishes, even from another page.
+    """
+    job = jobs.get(session.get('job_id'))
+    if job is not None and (job.kind, job.inputs) != (kind, inputs):
+        job.cancel()
+        job = None
+    if job is None:
+        job = jobs.submit(kind, session_user(), inputs, fn, *args)
+        session['job_id'] = job.id
+        job.wait(JOB_INLINE_WAIT_SECONDS)
+    if not job.finished:
+        show_job_progress(job.id)
+        st.stop()
+    if job.status == "cancelled":
+        st.warning("⏹️ Processing was cancelled.")
+        if st.button("▶️ Restart"):
+            session['job_id'] = None
+            st.rerun()
+        st.stop()
+    return job
+
+
+def stop_failed(session, message):
+    """Show why the session's job failed and stop, offering to run it again
+
+    A failed job is kept for its inputs, so without a retry its error would
+    stay even after the cause (rules, an expired upload) has been fixed.
+    """
+    st.error(message)
+    if st.button("🔁 Retry"):
+        session['job_id'] = None
+        st.rerun()
+    st.stop()
+
+
+def remember_result():
+    """Memoize this session's results for other sessions with the same inputs"""
+    # Keyed by the mapping version after any auto-adds; manually entered
+    # amounts aren't part of the key, so those runs aren't shared
+    if st.session_state.uploaded_files['manual_amounts']:
+        return
+    get_result_memo().put(
+        allocation_key(
+            st.session_state.uploaded_files['pdf_hashes'],
+            st.session_state.uploaded_files['users_hash'],
+            st.session_state.uploaded_files.get('vat_mode', 'auto'),
+        ),
+        {
+            'allocation_hash': st.session_state.uploaded_files['allocation_hash'],
+            'summary_hash': st.session_state.uploaded_files['summary_hash'],
+            'product_items': st.session_state.uploaded_files['product_items'],
+            'invoice_meta': st.session_state.uploaded_files['invoice_meta'],
+            'usage_hash': st.session_state.uploaded_files['usage_hash'],
+            'changes_hash': st.session_state.uploaded_files['changes_hash'],
+            'include_vat': st.session_state.uploaded_files['include_vat'],
+        },
+    )
+
+
+st.title("💰 Atlassian Expense Allocation")
+
+with st.expander("🔍 How it Works", expanded=False):
+    st.markdown("""
+    **Simple 3-step process:**
+
+    1. **📄 Upload Invoice PDF(s)** - One or more Atlassian invoices for the period (e.g. Jira, Confluence, Marketplace apps), or their CSV/JSON billing export
+    2. **👥 Upload Users CSV** - Export from your system (must contain 'email' column)  
+    3. **⚡ Auto-Processing** - App extracts amounts, maps users, calculates allocations
+    4. **📊 Download Results** - Get Excel files with detailed allocations
+
+    **New users** are automatically added to BU mapping with "Unknown" cost center.
+    You can edit mappings in the **BU Mapping Management** page.
+    """)
+
+st.divider()
+
+# File upload section with session state
+st.markdown("### 📁 Upload Files")
+col1, col2 = st.columns(2)
+
+with col1:
+    pdf_files = st.file_uploader(
+        "📄 Invoice PDF(s) or billing export",
+        type=["pdf", "csv", "json"],
+        key=f"pdf_files_{st.session_state.uploader_generation}",
+        accept_multiple_files=True,
+        help="Atlassian invoice PDFs, or the CSV/JSON billing export from Atlassian admin (read directly, no PDF parsing). Uploading again replaces the stored invoices."
+    )
+    # VAT handling - detected from the invoice layout unless overridden
+    vat_mode = st.radio(
+        "💰 VAT",
+        list(VAT_MODES),
+        format_func=VAT_MODES.get,
+        horizontal=True,
+        help="Auto-detect includes VAT for invoices with Tax and Amount columns and excludes it for older invoices with only 'Amount excl. tax'. Pick a mode to override."
+    )
+    # Store in session state
+    if pdf_files:
+        store_pdf_uploads(pdf_files)
+    # Store VAT preference in session state
+    st.session_state.uploaded_files['vat_mode'] = vat_mode
+
+with col2:
+    csv_file = st.file_uploader("👥 Users CSV", type=["csv"], key=f"csv_file_{st.session_state.uploader_generation}")
+    # Store in session state
+    if csv_file is not None:
+        store_upload(csv_file, 'csv_file', 'users_hash')
+
+# Once spilled, empty the uploaders (a fresh widget key) so the browser
+# upload isn't also held in memory for the rest of the session
+if pdf_files or csv_file is not None:
+    st.session_state.uploader_generation += 1
+    st.rerun()
+
+# Show uploaded file status
+if st.session_state.uploaded_files['pdf_files'] or st.session_state.uploaded_files['csv_file']:
+    st.markdown("**📋 Uploaded Files Status:**")
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.session_state.uploaded_files['pdf_files']:
+            st.success(f"✅ PDF: {', '.join(st.session_state.uploaded_files['pdf_files'])}")
+        else:
+            st.info("⏳ No PDF uploaded")
+    with col2:
+        if st.session_state.uploaded_files['csv_file']:
+            st.success(f"✅ CSV: {st.session_state.uploaded_files['csv_file']}")
+        else:
+            st.info("⏳ No CSV uploaded")
+
+    # Clear files button
+    col_clear1, col_clear2 = st.columns(2)
+    with col_clear1:
+        if st.button("🗑️ Clear All Files"):
+            jobs.cancel(st.session_state.uploaded_files['job_id'])
+            for key in st.session_state.uploaded_files.keys():
+                st.session_state.uploaded_files[key] = None
+            st.rerun()
+
+    with col_clear2:
+        if st.button("🔄 Clear Cache & Restart"):
+            st.session_state.clear()
+            st.rerun()
+
+
+@st.fragment
+def render_results():
+    """Results and downloads; download clicks rerun only this region"""
+    allocation = blob_store.get_frame(st.session_state.uploaded_files['allocation_hash'])
+    summary = blob_store.get_frame(st.session_state.uploaded_files['summary_hash'])
+    if allocation is None or summary is None:
+        st.warning("⏳ Cached results have expired. Please re-upload files to recalculate.")
+        return
+
+    st.markdown("### 📊 Allocation Results")
+    st.success("✅ Allocation data available!")
+    invoice_meta = st.session_state.uploaded_files.get('invoice_meta')
+    if invoice_meta:
+        st.caption(f"🧾 Invoice {invoice_meta.get('invoice_number') or 'unknown'} | Billing period {invoice_meta.get('period')} | Saved to allocation history")
+
+    # Show calculation summary
+    include_vat = st.session_state.uploaded_files.get('include_vat', False)
+    if include_vat:
+        st.info("💰 **Calculation includes VAT** - Using final Amount column from invoice")
+    else:
+        st.info("💰 **Calculation excludes VAT** - Using Amount excl. tax column from invoice")
+
+    st.markdown("**Preview (first 10 rows):**")
+    st.dataframe(allocation.head(10), hide_index=True, use_container_width=True)
+
+    st.markdown("### 🏢 Summary by Business Unit")
+    st.dataframe(summary, hide_index=True, use_container_width=True)
+
+    changes = blob_store.get_frame(st.session_state.uploaded_files.get('changes_hash'))
+    if changes is not None and not changes.empty:
+        counts = changes['Change'].value_counts()
+        with st.expander(
+            f"🔄 Changes since last period: {counts.get('Joined', 0)} joined, "
+            f"{counts.get('Left', 0)} left, {counts.get('Moved', 0)} moved BU",
+            expanded=False,
+        ):
+            st.dataframe(changes, hide_index=True, use_container_width=True)
+
+    # Download buttons
+    st.markdown("### 📥 Download Results")
+    col1, col2 = st.columns(2)
+
+    with col1:
+        # Summary download
+        with io.BytesIO() as buf:
+            summary.to_excel(buf, index=False)
+            st.download_button(
+                "📊 Download Summary by BU",
+                data=buf.getvalue(),
+                file_name="Expense_Allocation_Summary.xlsx",
+                use_container_width=True
+            )
+
+    with col2:
+        # Full allocation download - the per-user table is only built on request
+        export_format = st.radio("Format", list(EXPORT_FORMATS), horizontal=True, label_visibility="collapsed")
+        file_name, mime = EXPORT_FORMATS[export_format]
+        export_key = (st.session_state.uploaded_files['allocation_hash'], export_format)
+        export_bytes = None
+        if st.session_state.get('export_key') == export_key:
+            export_bytes = blob_store.get(st.session_state.export_hash)
+        # Built by a background job
+        export_job = jobs.get(st.session_state.get('export_job_id'))
+        if export_job is not None and (export_job.inputs != export_key
+                                       or export_job.status in ("failed", "cancelled")):
+            if export_job.inputs == export_key and export_job.status == "failed":
+                st.error(f"❌ Export failed: {export_job.error}")
+            export_job = None
+        # One slot: the button is swapped for the progress, then the download
+        export_slot = st.empty()
+        if export_bytes is None and export_job is None and export_slot.button(
+            f"📋 Prepare Full Allocation ({export_format})",
+            use_container_width=True,
+        ):
+            export_job = jobs.submit("export", session_user(), export_key, build_export, *export_key)
+            st.session_state.export_job_id = export_job.id
+            export_job.wait(JOB_INLINE_WAIT_SECONDS)
+        if export_bytes is None and export_job is not None:
+            if not export_job.finished:
+                with export_slot.container():
+                    show_job_progress(export_job.id)
+            elif export_job.result is not None:
+                st.session_state.export_hash = export_job.result
+                st.session_state.export_key = export_key
+                export_bytes = blob_store.get(export_job.result)
+            else:
+                st.warning("⏳ Cached results have expired. Please re-upload files to recalculate.")
+        if export_bytes is not None:
+            export_slot.download_button(
+                "📋 Download Full Allocation",
+                data=export_bytes,
+                file_name=file_name,
+                mime=mime,
+                use_container_width=True
+            )
+
+
+# Check if we have both files (either newly uploaded or from session)
+has_pdf = bool(st.session_state.uploaded_files['pdf_hashes']) and all(
+    blob_store.exists(digest) for digest in st.session_state.uploaded_files['pdf_hashes']
+)
+has_csv = blob_store.exists(st.session_state.uploaded_files['users_hash'])
+
+if has_pdf and has_csv:
+    st.divider()
+
+    # Parse Invoice (use session state data if available)
+    st.markdown("### 📄 Processing Invoice...")
+
+    vat_mode = st.session_state.uploaded_files.get('vat_mode', 'auto')
+
+    # The VAT mode changed - recompute from the parsed invoice lines
+    if (st.session_state.uploaded_files['allocation_hash'] is not None
+            and st.session_state.uploaded_files['results_vat_mode'] not in (None, vat_mode)):
+        st.session_state.uploaded_files['allocation_hash'] = None
+
+    # Only the BU mapping changed since the results were computed - apply the
+    # changed assignments without re-reading the PDF and users files
+    if (st.session_state.uploaded_files['allocation_hash'] is not None
+            and st.session_state.uploaded_files['product_items'] is not None
+            and st.session_state.uploaded_files['mapping_version'] != mapping_version()):
+        prev_allocation = blob_store.get_frame(st.session_state.uploaded_files['allocation_hash'])
+        prev_summary = blob_store.get_frame(st.session_state.uploaded_files['summary_hash'])
+        usage = blob_store.get_frame(st.session_state.uploaded_files['usage_hash'])
+        if (prev_allocation is None or prev_summary is None
+                or (usage is None and st.session_state.uploaded_files['usage_hash'] is not None)):
+            st.session_state.uploaded_files['allocation_hash'] = None
+        else:
+            with heavy_stage("re-allocation"):
+                allocation, summary, num_changed = reallocate(
+                    prev_allocation, prev_summary, st.session_state.uploaded_files['product_items'], load_bu_lookup(),
+                    usage,
+                )
+            st.session_state.uploaded_files['allocation_hash'] = blob_store.put_frame(allocation)
+            st.session_state.uploaded_files['summary_hash'] = blob_store.put_frame(summary)
+            st.session_state.uploaded_files['mapping_version'] = mapping_version()
+            remember_result()
+            invoice_meta = st.session_state.uploaded_files['invoice_meta']
+            if invoice_meta is not None:
+                try:
+                    save_allocation(allocation, invoice_meta)
+                    st.session_state.uploaded_files['history_overlap'] = None
+                except HistoryOverlapError as e:
+                    st.session_state.uploaded_files['history_overlap'] = str(e)
+                # Next period's report compares against the BUs used now
+                if num_changed > 0 and invoice_meta.get('period'):
+                    save_period(allocation.users.rename(columns={'Email': 'email'}), invoice_meta['period'])
+            if num_changed > 0:
+                st.info(f"🔁 Applied BU mapping changes for {num_changed} users without re-processing files.")
+
+    # Reuse results of an identical run (same files, mapping, VAT mode) from any session
+    if st.session_state.uploaded_files['allocation_hash'] is None:
+        memo_hit = get_result_memo().get(allocation_key(
+            st.session_state.uploaded_files['pdf_hashes'],
+            st.session_state.uploaded_files['users_hash'],
+            vat_mode,
+        ))
+        if memo_hit is not None:
+            st.session_state.uploaded_files['allocation_hash'] = memo_hit['allocation_hash']
+            st.session_state.uploaded_files['summary_hash'] = memo_hit['summary_hash']
+            st.session_state.uploaded_files['product_items'] = memo_hit['product_items']
+            st.session_state.uploaded_files['invoice_meta'] = memo_hit.get('invoice_meta')
+            st.session_state.uploaded_files['usage_hash'] = memo_hit.get('usage_hash')
+            st.session_state.uploaded_files['changes_hash'] = memo_hit.get('changes_hash')
+            st.session_state.uploaded_files['mapping_version'] = mapping_version()
+            st.session_state.uploaded_files['manual_amounts'] = False
+            st.session_state.uploaded_files['include_vat'] = memo_hit.get('include_vat', False)
+            st.session_state.uploaded_files['results_vat_mode'] = vat_mode
+            st.session_state.uploaded_files['history_overlap'] = None
+
+    if st.session_state.uploaded_files['allocation_hash'] is not None:
+        # Show cached results
+        st.info("📋 Using previously calculated results. Upload new files to recalculate.")
+        text = "Using cached data - PDF already processed"
+    elif st.session_state.uploaded_files['line_items'] is not None:
+        text = "Using parsed invoice lines - PDF not re-read"
+    else:
+        # Read and parse the invoices in the background
+        job = run_job(
+            st.session_state.uploaded_files, "parse", tuple(st.session_state.uploaded_files['pdf_hashes']),
+            parse_invoices, st.session_state.uploaded_files['pdf_files'], st.session_state.uploaded_files['pdf_hashes'],
+        )
+        if isinstance(job.error, PdfBudgetError):
+            stop_failed(st.session_state.uploaded_files,
+                        f"❌ {job.error}. Upload the invoice without its usage appendix or raise the limit.")
+        if isinstance(job.error, PdfValidationError):
+            stop_failed(st.session_state.uploaded_files, f"❌ {job.error}. Please upload the Atlassian invoice PDF.")
+        if job.error is not None:
+            stop_failed(st.session_state.uploaded_files, f"❌ {job.error}")
+        texts = job.result['texts']
+        text = "\n".join(
+            f"===== {name} =====\n{invoice_text}"
+            for name, invoice_text in zip(st.session_state.uploaded_files['pdf_files'], texts)
+        ) if len(texts) > 1 else texts[0]
+        st.session_state.uploaded_files['invoice_layouts'] = job.result['layouts']
+        st.session_state.uploaded_files['line_items'] = job.result['line_items']
+        st.session_state.uploaded_files['invoice_metas'] = job.result['metas']
+        st.session_state.uploaded_files['invoice_warnings'] = job.result['warnings']
+
+    with st.expander("📝 PDF Text Preview", expanded=False):
+        st.text_area("Extracted text:", text, height=200)
+
+    # Only process if not cached
+    if st.session_state.uploaded_files['allocation_hash'] is None:
+        for warning in st.session_state.uploaded_files['invoice_warnings'] or []:
+            st.warning(f"⚠️ {warning}")
+
+        # Product amounts for the selected (or per invoice detected) VAT mode
+        layouts = st.session_state.uploaded_files['invoice_layouts']
+        invoice_vat = [resolve_include_vat(vat_mode, layout) for layout in layouts]
+        include_vat = all(invoice_vat)
+        product_items = merge_invoice_items([
+            invoice_items(line_items, vat)
+            for line_items, vat in zip(st.session_state.uploaded_files['line_items'], invoice_vat)
+        ])
+
+        # Invoice number and billing period partition the allocation history
+        invoice_meta = merge_invoice_meta(st.session_state.uploaded_files['invoice_metas'])
+        if invoice_meta['period'] is None:
+            # No default: saving under a guessed month would file it in the wrong period
+            billing_month = st.date_input(
+                "🗓️ Billing period start (not found in the invoice)",
+                value=None,
+                key="billing_month",
+            )
+            if billing_month is None:
+                st.info("🗓️ Please pick the billing period to continue.")
+                st.stop()
+            invoice_meta['period'] = billing_month.strftime("%Y-%m")
+            invoice_meta['period_start'] = billing_month.replace(day=1).isoformat()
+
+        # Show calculation mode
+        vat_label = "Include VAT" if include_vat else "Exclude VAT"
+        if vat_mode == "auto":
+            vat_label = f"{vat_label} (auto-detected)" if len(set(invoice_vat)) == 1 else (
+                f"Include VAT for {sum(invoice_vat)} of {len(invoice_vat)} invoices (auto-detected)"
+            )
+        st.info(f"📊 **Calculation Mode:** {vat_label} - Using {'final Amount column' if include_vat else 'Amount excl. tax column'}")
+        if vat_mode == "auto" and any(layout['source'] == "unknown" for layout in layouts):
+            st.warning("⚠️ Could not detect the invoice column layout, so amounts excl. VAT were used. Pick a VAT mode above to override.")
+
+        missing = [i for i in product_items if i['amount'] is None]
+
+        # Manual input for missing amounts
+        if missing:
+            st.warning("⚠️ Could not auto-extract all amounts. Please enter missing values:")
+
+            for i in range(len(product_items)):
+                if product_items[i]['amount'] is None:
+                    manual = st.number_input(
+                        f"💰 Amount for: **{product_items[i]['desc']}**", 
+                        min_value=0.0, 
+                        format="%.2f", 
+                        key=f"manual_{i}"
+                    )
+                    product_items[i]['amount'] = manual
+
+            if any(i['amount'] is None or i['amount']==0 for i in product_items):
+                st.info("🔄 Please enter all missing amounts to continue.")
+                st.stop()
+
+        # Join users and allocate in the background; changed amounts or VAT
+        # mode cancel a run for the old inputs
+        st.markdown("### 👥 Processing Users...")
+        job = run_job(
+            st.session_state.uploaded_files, "allocate",
+            (st.session_state.uploaded_files['users_hash'], repr(product_items), repr(invoice_meta)),
+            allocate_invoice, st.session_state.uploaded_files['users_hash'], product_items, invoice_meta,
+        )
+        if job.error is not None:
+            stop_failed(st.session_state.uploaded_files, f"❌ {job.error}")
+        result = job.result
+        if result['num_auto_added'] > 0:
+            st.info(f"➕ Auto-added {result['num_auto_added']} new users with Cost To = '{DEFAULT_COST_TO}'. Edit in BU Mapping Management if needed.")
+        st.session_state.uploaded_files['changes_hash'] = result['changes_hash']
+        st.session_state.uploaded_files['history_overlap'] = result['history_overlap']
+
+        # Store results in session state
+        st.session_state.uploaded_files['allocation_hash'] = result['allocation_hash']
+        st.session_state.uploaded_files['summary_hash'] = result['summary_hash']
+        st.session_state.uploaded_files['usage_hash'] = result['usage_hash']
+        st.session_state.uploaded_files['product_items'] = product_items
+        st.session_state.uploaded_files['mapping_version'] = result['mapping_version']
+        st.session_state.uploaded_files['manual_amounts'] = bool(missing)
+        st.session_state.uploaded_files['invoice_meta'] = invoice_meta
+        st.session_state.uploaded_files['include_vat'] = include_vat
+        st.session_state.uploaded_files['results_vat_mode'] = vat_mode
+        remember_result()
+
+        st.divider()
+
+# Display results (either newly calculated or from session state)
+if st.session_state.uploaded_files['allocation_hash'] is not None:
+    if st.session_state.uploaded_files['history_overlap']:
+        st.warning(f"⚠️ **Not saved to history:** {st.session_state.uploaded_files['history_overlap']}. "
+                   "Upload all of those invoices together to keep their costs, or replace the stored runs.")
+        if st.button("🗂️ Replace in history"):
+            allocation = blob_store.get_frame(st.session_state.uploaded_files['allocation_hash'])
+            if allocation is None:
+                st.error("❌ Results have expired from the server cache; please upload the files again")
+            else:
+                save_allocation(allocation, st.session_state.uploaded_files['invoice_meta'], replace=True)
+                st.session_state.uploaded_files['history_overlap'] = None
+                st.rerun()
+    render_results()
+else:
+    st.info("📁 Please upload both Invoice PDF and Users CSV to proceed.")
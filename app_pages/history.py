@@ -0,0 +1,45 @@
+import streamlit as st
+
+from allocator.history import bu_product_costs, list_periods, user_charges
+
+st.title("📚 Allocation History")
+st.markdown("**Query completed allocations across billing periods**")
+
+periods = list_periods()
+if not periods:
+    st.info("📭 No allocations saved yet - run an allocation on the Expense Allocation page first.")
+    st.stop()
+
+# Period range - only partitions inside the range are read
+if len(periods) > 1:
+    start, end = st.select_slider("🗓️ Billing periods", options=periods, value=(periods[0], periods[-1]))
+else:
+    start = end = periods[0]
+    st.caption(f"🗓️ Billing period: {start}")
+
+tab_bu, tab_user = st.tabs(["🏢 Cost per BU and Product", "👤 User Charges"])
+
+with tab_bu:
+    costs = bu_product_costs(start, end)
+    if costs.empty:
+        st.info("No allocations in this range.")
+    else:
+        by_bu = costs.pivot_table(index='cost_to', columns='product', values='amount', aggfunc='sum', fill_value=0)
+        by_bu["Grand Total"] = by_bu.sum(axis=1)
+        st.dataframe(by_bu.rename_axis("Cost To").round(2), use_container_width=True)
+
+        with st.expander("📈 Per period", expanded=False):
+            by_period = costs.pivot_table(index=['period', 'cost_to'], columns='product', values='amount', aggfunc='sum', fill_value=0)
+            st.dataframe(by_period.round(2), use_container_width=True)
+
+with tab_user:
+    email = st.text_input("📧 User email")
+    if email:
+        charges = user_charges(email, start, end)
+        if charges.empty:
+            st.info(f"No charges for {email} in this range.")
+        else:
+            per_period = charges.pivot_table(index='period', columns='product', values='amount', aggfunc='sum', fill_value=0)
+            per_period["Total"] = per_period.sum(axis=1)
+            st.dataframe(per_period.round(2), use_container_width=True)
+            st.dataframe(charges, hide_index=True, use_container_width=True)
@@ -0,0 +1,54 @@
+"""Per-page invoice text extraction latency of each backend
+
+Usage: python benchmark_extraction.py invoice.pdf [more.pdf ...] [--repeat N]
+"""
+import argparse
+import os
+import time
+
+import pandas as pd
+
+from allocator.invoice import TEXT_BACKENDS, extract_invoice_items
+
+
+def page_count(data: bytes) -> int:
+    import pypdfium2
+
+    pdf = pypdfium2.PdfDocument(data)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pdfs", nargs="+")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per backend; the best is reported")
+    args = parser.parse_args()
+
+    rows = []
+    for path in args.pdfs:
+        with open(path, "rb") as f:
+            data = f.read()
+        pages = page_count(data)
+        for backend, extract in TEXT_BACKENDS.items():
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                text = '\n'.join(extract(data))
+                timings.append(time.perf_counter() - start)
+            best = min(timings)
+            rows.append({
+                "invoice": os.path.basename(path),
+                "pages": pages,
+                "backend": backend,
+                "total ms": round(best * 1000, 1),
+                "ms/page": round(best * 1000 / max(pages, 1), 2),
+                "products found": sum(item["amount"] is not None for item in extract_invoice_items(text)),
+            })
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
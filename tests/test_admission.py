@@ -0,0 +1,98 @@
+"""Fair, weighted admission to the heavy-work slots"""
+import threading
+import time
+
+import pytest
+
+from allocator import admission
+from allocator.admission import AdmissionQueue
+
+
+@pytest.fixture(autouse=True)
+def slot_locks(tmp_path, monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_LOCK_PATTERN", str(tmp_path / "admission-slot-{}.lock"))
+
+
+class Stages:
+    """Stages running in threads, each holding its slots until released"""
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.running = set()
+        self.released = {}
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def start(self, user, name, weight=1):
+        waiting = len(self.queue._waiting)
+        self.released[name] = threading.Event()
+        thread = threading.Thread(target=self._run, args=(user, name, weight), daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        # Queue in the order started, unless admitted straight away
+        wait_until(lambda: len(self.queue._waiting) > waiting or name in self.running)
+
+    def _run(self, user, name, weight):
+        with self.queue.slot(user, name, weight):
+            with self.lock:
+                self.running.add(name)
+            self.released[name].wait()
+            with self.lock:
+                self.running.discard(name)
+
+    def release(self, name):
+        self.released[name].set()
+
+    def assert_running(self, *names):
+        wait_until(lambda: self.running == set(names))
+        time.sleep(0.1)  # nothing else gets in
+        assert self.running == set(names)
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_users_take_turns_and_weights_are_respected(monkeypatch):
+    monkeypatch.setattr(admission, "fcntl", None)  # this process's own accounting only
+    stages = Stages(AdmissionQueue(slots=2))
+    stages.start("alice", "alice-0", weight=2)
+    stages.assert_running("alice-0")
+    stages.start("alice", "alice-1")
+    stages.start("alice", "alice-2")
+    stages.start("bob", "bob-1", weight=2)
+    stages.start("bob", "bob-2")
+
+    # Bob hasn't had a turn yet, so his two-slot stage goes first and waits for both slots
+    stages.release("alice-0")
+    stages.assert_running("bob-1")
+    # Then one stage each
+    stages.release("bob-1")
+    stages.assert_running("alice-1", "bob-2")
+    stages.release("alice-1")
+    stages.assert_running("alice-2", "bob-2")
+    # A two-slot stage waits while one slot is still taken
+    stages.start("bob", "bob-3", weight=2)
+    stages.release("bob-2")
+    stages.assert_running("alice-2")
+    stages.release("alice-2")
+    stages.assert_running("bob-3")
+    stages.release("bob-3")
+    for thread in stages.threads:
+        thread.join(5)
+    assert not stages.queue._served and not stages.queue._running
+
+
+def test_slots_are_shared_with_other_processes():
+    # Each queue stands in for one app process; the slot lock files are common
+    ui, api = Stages(AdmissionQueue(slots=1)), Stages(AdmissionQueue(slots=1))
+    ui.start("alice", "ui")
+    ui.assert_running("ui")
+    api.start("bob", "api")
+    api.assert_running()
+    ui.release("ui")
+    api.assert_running("api")
+    api.release("api")
@@ -0,0 +1,78 @@
+"""CSV and JSON billing exports read into the same line items as a PDF invoice"""
+import json
+
+from allocator.billing_export import is_billing_export, parse_billing_export
+from allocator.invoice import PRODUCT_ITEMS
+
+PRODUCTS = [name for name, _ in PRODUCT_ITEMS]
+
+VAT_CSV = """Invoice Number,Billing Period Start,Billing Period End,Description,Quantity,Unit Price,Amount excl. tax,Tax,Amount,Currency
+IN-004-123456,2025-09-01,2025-10-01,Confluence Standard (Cloud),30,10.0,300.0,21.0,"USD 321.00",USD
+IN-004-123456,2025-09-01,2025-10-01,draw.io Diagrams | Confluence,30,1.0,30.0,2.1,"USD 32.10",USD
+IN-004-123456,2025-09-01,2025-10-01,Jira Service Management Standard,14,20.0,280.0,19.6,"USD 299.60",USD
+IN-004-123456,2025-09-01,2025-10-01,Jira Service Management Standard (proration),2,20.0,40.0,2.8,"USD 42.80",USD
+"""
+
+
+def item(items, name):
+    return items[PRODUCTS.index(name)]
+
+
+def test_csv_with_vat_columns():
+    items, meta, layout = parse_billing_export(VAT_CSV.encode())
+    assert meta == {"invoice_number": "IN-004-123456", "period": "2025-09",
+                    "period_start": "2025-09-01", "period_end": "2025-10-01"}
+    assert layout == {"money_columns": ["unit_price", "amount_excl_tax", "tax", "amount_incl_tax"],
+                      "has_vat": True, "source": "export"}
+    confluence = item(items, "Confluence")
+    assert (confluence.quantity, confluence.amount(False), confluence.amount(True)) == (30, 300.0, 321.0)
+    assert confluence.currency == "USD"
+    assert item(items, "Jira, Standard") is None
+
+
+def test_rows_of_one_product_are_summed():
+    items, _, _ = parse_billing_export(VAT_CSV.encode())
+    service = item(items, "Jira Service")
+    assert service.quantity == 16
+    assert (service.amount_excl_tax, service.tax, service.amount_incl_tax) == (320.0, 22.4, 342.4)
+
+
+def test_app_rows_go_to_the_app_not_the_host_product():
+    items, _, _ = parse_billing_export(VAT_CSV.encode())
+    assert item(items, "draw.io Diagrams |").amount(False) == 30.0
+    assert item(items, "Confluence").amount(False) == 300.0
+    assert item(items, "draw.io Diagrams for") is None
+
+
+def test_csv_without_vat_reads_a_plain_amount_as_excl_tax():
+    csv = "Product,Users,Cost\nConfluence Standard,30,300.00\nJira Standard,52,447.20\n"
+    items, meta, layout = parse_billing_export(csv.encode())
+    assert layout["money_columns"] == ["amount_excl_tax"] and not layout["has_vat"]
+    assert item(items, "Confluence").amount(True) == 300.0
+    assert meta["period"] is None
+
+
+def test_json_export_with_header_fields():
+    document = {
+        "invoiceNumber": "IN-004-654321",
+        "billingPeriod": {"start": "2025-10-01", "end": "2025-11-01"},
+        "lineItems": [
+            {"productName": "Confluence Standard (Cloud)", "quantity": 30, "amountExclTax": 300.0,
+             "taxAmount": 21.0, "total": 321.0},
+            {"productName": "draw.io Diagrams for Jira", "quantity": 52, "amountExclTax": 52.0,
+             "taxAmount": 3.64, "total": 55.64},
+            {"productName": "Jira, Standard (Cloud)", "quantity": 50, "amountExclTax": 430.0, "taxAmount": 30.1,
+             "total": 460.1},
+            {"productName": "Jira, Standard (Cloud) - added users", "quantity": 2, "amountExclTax": 17.2,
+             "taxAmount": 1.2, "total": 18.4},
+        ],
+    }
+    data = json.dumps(document).encode()
+    assert is_billing_export(data) and not is_billing_export(b"%PDF-1.7")
+    items, meta, layout = parse_billing_export(data)
+    assert (meta["invoice_number"], meta["period"], meta["period_end"]) == ("IN-004-654321", "2025-10", "2025-11-01")
+    assert layout["has_vat"]
+    assert item(items, "draw.io Diagrams for").amount(True) == 55.64
+    assert item(items, "Confluence").amount(True) == 321.0
+    jira = item(items, "Jira, Standard")
+    assert (jira.quantity, jira.amount(False), jira.amount(True)) == (52, 447.2, 478.5)
@@ -0,0 +1,137 @@
+"""Cent-exact splits, and incremental re-allocation matching a full allocation"""
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from allocator import rules as rules_module
+from allocator.engine import allocate, reallocate, split_cents
+from allocator.rules import CompiledRule, _largest_remainder, user_arrays, usage_matrix
+
+PRODUCT_ITEMS = [
+    {"desc": "Confluence", "amount": 1234.57, "count": 30},
+    {"desc": "Jira, Standard", "amount": 999.99, "count": 52},
+    {"desc": "Jira Service", "amount": 100.01, "count": 14},
+]
+BUS = ["IT", "Finance", "HR", "Sales"]
+
+
+@pytest.fixture
+def rules_file(tmp_path, monkeypatch):
+    """Point the engine at a rules file written by the test"""
+    path = tmp_path / "allocation_rules.json"
+    monkeypatch.setattr(rules_module, "RULES_FILE", str(path))
+    monkeypatch.setattr(rules_module, "_rules_cache", None)
+
+    def write(raw):
+        path.write_text(json.dumps(raw))
+        rules_module._rules_cache = None
+    return write
+
+
+def make_users(n=37, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "User name": [f"User {i}" for i in range(n)],
+        "email": [f"user{i}@{'corp' if i % 3 else 'contractor'}.com" for i in range(n)],
+        "Cost To": rng.choice(BUS, n),
+        "seats": rng.integers(0, 5, n),
+    })
+
+
+def test_split_cents_columns_sum_to_invoice_amounts():
+    rng = np.random.default_rng(1)
+    for n in (1, 3, 7, 101):
+        raw = rng.random((n, 4))
+        raw[:, 3] = 0  # nobody eligible
+        weights = np.divide(raw, raw.sum(axis=0), out=np.zeros_like(raw), where=raw.sum(axis=0) > 0)
+        amounts = [100.01, 0.07, 12345.67, 50.0]
+        cents = split_cents(weights, amounts)
+        assert cents[:, :3].sum(axis=0).tolist() == [10001, 7, 1234567]
+        assert not cents[:, 3].any()
+        # Nobody is more than a cent away from their exact share
+        assert (np.abs(cents - weights * np.round(np.array(amounts) * 100)) < 1).all()
+
+
+def test_split_cents_ties_go_to_earlier_rows():
+    cents = split_cents(np.full((3, 1), 1 / 3), [0.02])
+    assert cents[:, 0].tolist() == [1, 1, 0]
+
+
+def test_largest_remainder_is_exact():
+    exact = np.array([33.4, 33.3, 33.3])
+    assert _largest_remainder(exact, 100).tolist() == [34, 33, 33]
+    assert _largest_remainder(np.array([0.5, 0.5]), 1).sum() == 1
+
+
+def test_bu_percentages_are_exact_per_bu():
+    users = make_users(50)
+    rule = CompiledRule({"bu_percentages": {"IT": 50, "Finance": 30, "HR": 20}})
+    arrays = user_arrays(users["Cost To"], users["email"])
+    cents = rule.bu_cents(10001, *arrays)
+    assert cents.sum() == 10001
+    per_bu = pd.Series(cents).groupby(users["Cost To"].to_numpy()).sum()
+    assert per_bu.get("Sales", 0) == 0
+    assert sorted(per_bu[["IT", "Finance", "HR"]].tolist()) == sorted(
+        _largest_remainder(np.array([5000.5, 3000.3, 2000.2]), 10001).tolist()
+    )
+
+
+def test_weighted_bu_percentages_are_exact_per_bu():
+    users = make_users(50, seed=2)
+    rule = CompiledRule({"bu_percentages": {"IT": 60, "Sales": 40}, "weight_by": "seats"})
+    arrays = user_arrays(users["Cost To"], users["email"])
+    cents = rule.bu_cents(99999, *arrays, users["seats"].to_numpy(dtype=float))
+    per_bu = pd.Series(cents).groupby(users["Cost To"].to_numpy()).sum()
+    assert cents.sum() == 99999
+    assert per_bu["IT"] + per_bu["Sales"] == 99999
+    assert abs(per_bu["IT"] - 59999.4) < 1
+
+
+RULE_SETS = {
+    "plain": {"Jira Service": {"bu_in": ["IT"]}},
+    "weighted": {
+        "Jira Service": {"bu_not_in": ["HR"], "weight_by": "seats"},
+        "Confluence": {"email_domains": ["corp.com"], "weight_by": "seats"},
+    },
+    "percentages": {
+        "Jira Service": {"bu_percentages": {"IT": 50, "Finance": 30, "HR": 20}},
+        "Jira, Standard": {"bu_percentages": {"IT": 70, "Sales": 30}, "weight_by": "seats"},
+    },
+}
+
+
+@pytest.mark.parametrize("rule_set", sorted(RULE_SETS))
+def test_reallocate_matches_full_allocation(rules_file, rule_set):
+    rules_file(RULE_SETS[rule_set])
+    users = make_users()
+    names = [p["desc"] for p in PRODUCT_ITEMS]
+    usage = usage_matrix(names, users)
+    allocation, summary = allocate(users.copy(), PRODUCT_ITEMS, usage)
+
+    # Move a few users between BUs, including into and out of IT and HR
+    lookup = pd.Series(users["Cost To"].to_numpy(), index=users["email"])
+    lookup.iloc[[0, 5, 11, 20]] = ["IT", "HR", "Finance", "IT"]
+    lookup.iloc[[3, 8]] = ["Sales", "HR"]
+    moved = users.assign(**{"Cost To": users["email"].map(lookup)})
+
+    updated, updated_summary, num_changed = reallocate(allocation, summary, PRODUCT_ITEMS, lookup, usage)
+    expected, expected_summary = allocate(moved.copy(), PRODUCT_ITEMS, usage)
+
+    assert num_changed == int((moved["Cost To"] != users["Cost To"]).sum())
+    pd.testing.assert_frame_equal(updated.to_frame(), expected.to_frame())
+    pd.testing.assert_frame_equal(updated_summary.reset_index(drop=True), expected_summary.reset_index(drop=True),
+                                  check_dtype=False)
+    # Every product still adds up to its invoice amount, to the cent
+    for item in PRODUCT_ITEMS:
+        assert round(updated_summary[item["desc"]].sum() * 100) == round(item["amount"] * 100)
+
+
+def test_reallocate_without_changes_returns_inputs(rules_file):
+    rules_file(RULE_SETS["plain"])
+    users = make_users()
+    allocation, summary = allocate(users.copy(), PRODUCT_ITEMS)
+    lookup = pd.Series(users["Cost To"].to_numpy(), index=users["email"])
+    updated, updated_summary, num_changed = reallocate(allocation, summary, PRODUCT_ITEMS, lookup)
+    assert updated is allocation and updated_summary is summary and num_changed == 0
@@ -0,0 +1,66 @@
+"""Each invoice is stored once in the allocation history and the cube"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from allocator import history
+from allocator.engine import SparseAllocation
+from allocator.history import HistoryOverlapError, bu_product_costs, list_periods, load_cube, save_allocation
+
+
+@pytest.fixture(autouse=True)
+def history_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(history, "HISTORY_DIR", str(tmp_path / "history"))
+    monkeypatch.setattr(history, "CUBE_FILE", str(tmp_path / "history" / "cube.parquet"))
+
+
+def make_allocation(cents):
+    users = pd.DataFrame({"User name": ["A", "B"], "Email": ["a@x.com", "b@x.com"], "Cost To": ["IT", "HR"]})
+    return SparseAllocation(users, ["Jira"], np.array([0, 1], dtype=np.int32), np.zeros(2, dtype=np.int16),
+                            np.array(cents, dtype=np.int64))
+
+
+def meta(period, key, number=None):
+    return {"invoice_number": number, "invoice_key": key, "period": period, "period_start": f"{period}-01"}
+
+
+def slices():
+    return sorted(map(tuple, load_cube()[['period', 'invoice_number']].drop_duplicates().values.tolist()))
+
+
+def test_redated_invoice_moves_to_its_new_period():
+    save_allocation(make_allocation([100, 200]), meta("2025-10", "IN-1", "IN-1"))
+    save_allocation(make_allocation([100, 200]), meta("2025-09", "IN-1", "IN-1"))
+    assert list_periods() == ["2025-09"]
+    assert slices() == [("2025-09", "IN-1")]
+    assert bu_product_costs()['amount'].sum() == 3.0
+
+
+def test_invoices_without_a_number_do_not_overwrite_each_other():
+    save_allocation(make_allocation([100, 200]), meta("2025-09", "unknown-aaaa"))
+    save_allocation(make_allocation([300, 400]), meta("2025-09", "unknown-bbbb"))
+    assert slices() == [("2025-09", "unknown-aaaa"), ("2025-09", "unknown-bbbb")]
+    assert bu_product_costs()['amount'].sum() == 10.0
+
+
+def test_combined_run_replaces_its_single_invoices():
+    save_allocation(make_allocation([50, 50]), meta("2025-09", "IN-1", "IN-1"))
+    save_allocation(make_allocation([70, 80]), meta("2025-09", "IN-3", "IN-3"))
+    save_allocation(make_allocation([100, 200]), meta("2025-09", "IN-1+IN-2", "IN-1+IN-2"))
+    assert slices() == [("2025-09", "IN-1+IN-2"), ("2025-09", "IN-3")]
+    assert bu_product_costs()['amount'].sum() == 4.5
+
+
+def test_single_invoice_does_not_silently_drop_a_combined_run():
+    save_allocation(make_allocation([100, 200]), meta("2025-09", "IN-1+IN-2", "IN-1+IN-2"))
+    with pytest.raises(HistoryOverlapError) as overlap:
+        save_allocation(make_allocation([50, 50]), meta("2025-09", "IN-1", "IN-1"))
+    assert overlap.value.dropped == ["IN-2"]
+    assert slices() == [("2025-09", "IN-1+IN-2")]
+    assert bu_product_costs()['amount'].sum() == 3.0
+
+    save_allocation(make_allocation([50, 50]), meta("2025-09", "IN-1", "IN-1"), replace=True)
+    assert slices() == [("2025-09", "IN-1")]
+    assert os.listdir(os.path.join(history.HISTORY_DIR, "period=2025-09")) == ["invoice=IN-1.parquet"]
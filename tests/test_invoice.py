@@ -0,0 +1,33 @@
+"""Invoice line parsing"""
+from allocator.invoice import _parse_line, has_product_lines, header_money_columns, parse_line_items
+from allocator import layout
+from allocator.layout import LayoutCache, detect_layout
+
+
+def test_product_lines_in_any_currency_pass_the_fast_path():
+    assert has_product_lines("Confluence Standard 30 users EUR 10.00 EUR 300.00")
+    assert has_product_lines("Jira, Standard 52 users USD 8.60 USD 447.20")
+    assert not has_product_lines("Confluence Standard 30 users")
+    assert not has_product_lines("Invoice IN-004-123456")
+
+
+def test_headerless_lines_keep_the_amount_excl_tax():
+    two = _parse_line("Confluence Standard 30 users USD 5.16 USD 154.80", None)
+    assert (two.unit_price, two.amount_excl_tax, two.tax, two.amount_incl_tax) == (5.16, 154.80, None, None)
+    assert two.amount(False) == two.amount(True) == 154.80
+    assert _parse_line("Confluence Standard 30 users USD 154.80", None).amount(False) == 154.80
+    four = _parse_line("Confluence Standard 30 users USD 10.00 USD 300.00 USD 21.00 USD 321.00", None)
+    assert (four.amount(False), four.amount(True)) == (300.00, 321.00)
+
+
+def test_plain_amount_without_a_tax_column_is_excl_tax(tmp_path, monkeypatch):
+    cache = LayoutCache(str(tmp_path / "layouts.json"))
+    monkeypatch.setattr(layout, "get_layout_cache", lambda: cache)
+    text = "Description Quantity Unit price Amount\nConfluence Standard 30 users USD 5.16 USD 154.80\n"
+    assert header_money_columns(text) == ["unit_price", "amount_excl_tax"]
+    confluence = parse_line_items(text)[0]
+    assert confluence.amount(False) == confluence.amount(True) == 154.80
+    assert not detect_layout(text)["has_vat"]
+
+    with_tax = "Description Unit price Amount excl. tax Tax Amount\n"
+    assert header_money_columns(with_tax) == ["unit_price", "amount_excl_tax", "tax", "amount_incl_tax"]
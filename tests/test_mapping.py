@@ -0,0 +1,51 @@
+"""BU mapping versions"""
+import time
+
+import pandas as pd
+import pytest
+
+from allocator import mapping
+from allocator.mapping import load_bu_mapping, mapping_version, save_bu_mapping
+
+
+@pytest.fixture(autouse=True)
+def mapping_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(mapping, "PERSIST_FILE", str(tmp_path / "bu_mapping.xlsx"))
+    monkeypatch.setattr(mapping, "_version_cache", None)
+    save_bu_mapping(pd.DataFrame({
+        "User name": ["A", "B"], "Email": ["a@x.com", "B@x.com"], "Cost To": ["IT", "HR"],
+    }))
+
+
+def test_resaving_the_same_assignments_keeps_the_version():
+    version = mapping_version()
+    time.sleep(1.1)  # the workbook's timestamp changes
+    bu_df = load_bu_mapping()
+    save_bu_mapping(bu_df)
+    assert mapping_version() == version
+    # Row order, email case and names don't change any assignment
+    save_bu_mapping(bu_df.iloc[::-1].assign(**{"Email": ["b@x.com", "A@X.COM"], "User name": ["Bea", "Al"]}))
+    assert mapping_version() == version
+
+
+def test_moving_a_user_changes_the_version():
+    version = mapping_version()
+    bu_df = load_bu_mapping()
+    bu_df.loc[1, "Cost To"] = "Finance"
+    save_bu_mapping(bu_df)
+    assert mapping_version() != version
+
+
+def test_replacing_a_mapping_changed_since_it_was_loaded_is_refused():
+    stamp = mapping.mapping_stamp()
+    edited = load_bu_mapping()
+    edited.loc[0, "Cost To"] = "Sales"
+    # Meanwhile the API (or an allocation) adds a user
+    with mapping.mapping_lock():
+        save_bu_mapping(pd.concat([load_bu_mapping(), pd.DataFrame([["C", "c@x.com", "IT"]], columns=mapping.COLUMNS)]))
+    with pytest.raises(mapping.MappingChangedError):
+        mapping.replace_bu_mapping(edited, stamp)
+    assert load_bu_mapping()["Email"].tolist() == ["a@x.com", "B@x.com", "c@x.com"]
+
+    mapping.replace_bu_mapping(edited, mapping.mapping_stamp())
+    assert load_bu_mapping()["Cost To"].tolist() == ["Sales", "HR"]
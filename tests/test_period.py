@@ -0,0 +1,59 @@
+"""Per-period user snapshots and the joiner/leaver/move report"""
+import pandas as pd
+import pytest
+
+from allocator import mapping, period
+from allocator.period import load_previous_period, merge_users_with_previous, save_period
+
+
+@pytest.fixture(autouse=True)
+def stores(tmp_path, monkeypatch):
+    monkeypatch.setattr(period, "PERIOD_SNAPSHOT_DIR", str(tmp_path / "periods"))
+    monkeypatch.setattr(mapping, "PERSIST_FILE", str(tmp_path / "bu_mapping.xlsx"))
+    mapping.save_bu_mapping(pd.DataFrame({
+        "User name": ["A", "B", "C"], "Email": ["a@x.com", "b@x.com", "c@x.com"], "Cost To": ["IT", "HR", "IT"],
+    }))
+
+
+def users(*emails):
+    return pd.DataFrame({"email": list(emails), "User name": [e[0].upper() for e in emails]})
+
+
+def changes(report):
+    return report["Change"].value_counts().to_dict()
+
+
+def test_rerunning_a_period_keeps_its_baseline():
+    merged, _, _ = merge_users_with_previous(users("a@x.com", "b@x.com"), None)
+    save_period(merged, "2025-08")
+    for _ in range(2):
+        merged, _, report = merge_users_with_previous(users("a@x.com", "c@x.com"), load_previous_period("2025-09"))
+        save_period(merged, "2025-09")
+        assert changes(report) == {"Joined": 1, "Left": 1}
+
+
+def test_backfill_is_not_a_baseline_for_later_periods():
+    merged, _, _ = merge_users_with_previous(users("a@x.com"), None)
+    save_period(merged, "2025-08")
+    merged, _, _ = merge_users_with_previous(users("a@x.com", "b@x.com", "c@x.com"), None)
+    save_period(merged, "2025-03")
+    assert load_previous_period("2025-09")["period"] == "2025-08"
+    assert load_previous_period("2025-08")["period"] == "2025-03"
+    assert load_previous_period("2025-03") is None
+
+
+def test_only_edited_mapping_rows_move_users():
+    merged, _, _ = merge_users_with_previous(users("a@x.com", "b@x.com", "c@x.com"), None)
+    save_period(merged, "2025-08")
+    bu_df = mapping.load_bu_mapping()
+    bu_df.loc[bu_df["Email"] == "b@x.com", "Cost To"] = "Finance"
+    bu_df.loc[len(bu_df)] = ["D", "d@x.com", "Sales"]
+    mapping.save_bu_mapping(bu_df)
+
+    merged, num_auto_added, report = merge_users_with_previous(
+        users("a@x.com", "b@x.com", "c@x.com", "e@x.com"), load_previous_period("2025-09"))
+    assert merged.set_index("email")["Cost To"].to_dict() == {
+        "a@x.com": "IT", "b@x.com": "Finance", "c@x.com": "IT", "e@x.com": mapping.DEFAULT_COST_TO,
+    }
+    assert num_auto_added == 1
+    assert changes(report) == {"Joined": 1, "Moved": 1}